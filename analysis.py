@@ -0,0 +1,281 @@
+"""Summarise reaction times and accuracy across session files.
+
+Scans a directory for the files `haptic.DataWriter` writes (JSON
+lines or CSV) and summarises every trial record in them, such as a
+`LexDecTrial`'s, per participant and per stimulus. Files are parsed
+on a process pool, each reduced to partial aggregates that are
+merged as they finish, so the work scales with the number of cores
+and memory stays bounded however many sessions there are. From the
+repository root:
+
+    python analysis.py data -o summary.csv
+    python analysis.py data --answers answers.csv --jobs 8
+
+Each participant is one session file unless the records carry a
+``participant`` key. A trial is scored as correct from its
+``data["correct"]``, or by comparing ``data["response"]`` with the
+stimulus' answer in the `--answers` file.
+"""
+import argparse
+import concurrent.futures
+import csv
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+# Columns of a partial aggregate, one row per stimulus. Reaction
+#  times are kept as a count, mean and sum of squared deviations
+#  from the mean, which merge without losing precision.
+TRIALS, RESPONSES, TIMEOUTS, RT_N, RT_MEAN, RT_M2, SCORED, CORRECT = range(8)
+FIELDS = 8
+
+TIMEOUT_RESPONSES = (None, "", "NA")
+
+
+def findSessions(root, pattern=(".jsonl", ".csv")):
+    """Yield the session files under `root`, in sorted order."""
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(pattern):
+                yield os.path.join(directory, name)
+
+
+def readRecords(path):
+    """Yield the records of a session file one at a time.
+
+    JSON lines files yield the logged dictionaries. CSV rows keep
+    `haptic.DataWriter`'s dotted column names, so nested values are
+    found under keys like ``"data.rt"``.
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _field(record, name):
+    """Get ``record["data"][name]`` from a nested or flattened record."""
+    try:
+        return record["data"][name]
+    except (KeyError, TypeError):
+        return record.get(f"data.{name}")
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return value
+
+
+def _correct(value):
+    """Parse a correctness flag; NaN when it is missing."""
+    if value in (None, ""):
+        return math.nan
+    if isinstance(value, str):
+        return float(value.lower() in ("true", "1", "yes"))
+    return float(bool(value))
+
+
+def summariseFile(path, answers=None):
+    """Reduce one session file to per-stimulus partial aggregates.
+
+    Arguments:
+      path (string): A JSON lines or CSV session file.
+
+    Keyword arguments:
+      answers (dictionary): The correct response of each stimulus.
+
+    Returns:
+      A dictionary mapping each participant in the file to a pair
+      of the stimulus names and a ``(stimuli, FIELDS)`` array of
+      their aggregates. Records that are not trials are skipped.
+    """
+    default = os.path.splitext(os.path.basename(path))[0]
+    participants, stimuli, rts, responded, correct = [], [], [], [], []
+    for record in readRecords(path):
+        stimulus = record.get("trial_name")
+        if stimulus in (None, ""):
+            continue
+        response = _field(record, "response")
+        participants.append(record.get("participant") or default)
+        stimuli.append(str(stimulus))
+        rts.append(_number(_field(record, "rt")))
+        responded.append(response not in TIMEOUT_RESPONSES)
+        flag = _correct(_field(record, "correct"))
+        if math.isnan(flag) and answers and responded[-1]:
+            try:
+                flag = float(str(response) == answers[str(stimulus)])
+            except KeyError:
+                pass
+        correct.append(flag)
+
+    partials = {}
+    if not stimuli:
+        return partials
+    participants = np.asarray(participants)
+    stimuli = np.asarray(stimuli)
+    rts = np.asarray(rts)
+    responded = np.asarray(responded)
+    correct = np.asarray(correct)
+    for participant in np.unique(participants):
+        rows = participants == participant
+        names, group = np.unique(stimuli[rows], return_inverse=True)
+        sums = _aggregate(group, len(names), rts[rows], responded[rows], correct[rows])
+        partials[str(participant)] = (names.tolist(), sums)
+    return partials
+
+
+def _aggregate(group, n, rts, responded, correct):
+    """Aggregate each field over the trials of each group."""
+    sums = np.zeros((n, FIELDS))
+    hasRT = responded & ~np.isnan(rts)
+    rt = np.where(hasRT, rts, 0.0)
+    scored = ~np.isnan(correct)
+    sums[:, TRIALS] = np.bincount(group, minlength=n)
+    sums[:, RESPONSES] = np.bincount(group, responded, minlength=n)
+    sums[:, TIMEOUTS] = sums[:, TRIALS] - sums[:, RESPONSES]
+    count = np.bincount(group, hasRT, minlength=n)
+    total = np.bincount(group, rt, minlength=n)
+    mean = np.divide(total, count, out=np.zeros(n), where=count > 0)
+    deviation = np.where(hasRT, rt - mean[group], 0.0)
+    sums[:, RT_N] = count
+    sums[:, RT_MEAN] = mean
+    sums[:, RT_M2] = np.bincount(group, deviation * deviation, minlength=n)
+    sums[:, SCORED] = np.bincount(group, scored, minlength=n)
+    sums[:, CORRECT] = np.bincount(group, np.where(scored, correct, 0.0), minlength=n)
+    return sums
+
+
+def _merge(a, b):
+    """Merge two partial aggregates into a new one.
+
+    Counts add; reaction time means and squared deviations use
+    Chan et al.'s parallel update, so merging many small groups
+    is as precise as aggregating their trials together.
+    """
+    merged = a + b
+    n = merged[RT_N]
+    if n:
+        delta = b[RT_MEAN] - a[RT_MEAN]
+        merged[RT_MEAN] = a[RT_MEAN] + delta * b[RT_N] / n
+        merged[RT_M2] = a[RT_M2] + b[RT_M2] + delta * delta * a[RT_N] * b[RT_N] / n
+    return merged
+
+
+class Totals:
+    """Partial aggregates merged by key."""
+
+    def __init__(self):
+        self.sums = {}
+
+    def add(self, key, sums):
+        try:
+            self.sums[key] = _merge(self.sums[key], sums)
+        except KeyError:
+            self.sums[key] = np.array(sums, dtype=float)
+
+    def rows(self, level):
+        """Yield a summary row for every key, in sorted order."""
+        for key in sorted(self.sums):
+            s = self.sums[key]
+            n = s[RT_N]
+            mean = s[RT_MEAN] if n else math.nan
+            var = s[RT_M2] / (n - 1) if n > 1 else math.nan
+            yield {
+                "level": level,
+                "id": key,
+                "trials": int(s[TRIALS]),
+                "responses": int(s[RESPONSES]),
+                "timeouts": int(s[TIMEOUTS]),
+                "rt_mean": mean,
+                "rt_sd": math.sqrt(var) if n > 1 else math.nan,
+                "accuracy": s[CORRECT] / s[SCORED] if s[SCORED] else math.nan,
+                "scored": int(s[SCORED]),
+            }
+
+
+def analyse(paths, answers=None, jobs=None, inFlight=None):
+    """Summarise session files on a process pool.
+
+    At most `inFlight` files are submitted at once and each result
+    is merged as soon as it arrives, so only the running totals and
+    a bounded number of pending results are ever held in memory.
+
+    Returns:
+      A pair of `Totals`, per participant and per stimulus.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    inFlight = inFlight or 2 * jobs
+    byParticipant, byStimulus = Totals(), Totals()
+    paths = iter(paths)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        pending = set()
+        while True:
+            for path in paths:
+                pending.add(pool.submit(summariseFile, path, answers))
+                if len(pending) >= inFlight:
+                    break
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                for participant, (names, sums) in future.result().items():
+                    for name, row in zip(names, sums):
+                        byParticipant.add(participant, row)
+                        byStimulus.add(name, row)
+    return byParticipant, byStimulus
+
+
+def _cell(value):
+    """Write missing values as NA, like timed out responses."""
+    if isinstance(value, float) and math.isnan(value):
+        return "NA"
+    return value
+
+
+def readAnswers(path):
+    """Read a CSV of ``stimulus,answer`` rows."""
+    with open(path, newline="") as f:
+        return {row[0]: row[1] for row in csv.reader(f) if len(row) >= 2}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="directory of session files")
+    parser.add_argument(
+        "-o", "--output", help="write the table to this CSV file instead of stdout"
+    )
+    parser.add_argument("--answers", help="CSV of stimulus,answer rows")
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes")
+    args = parser.parse_args(argv)
+
+    answers = readAnswers(args.answers) if args.answers else None
+    sessions = findSessions(args.directory)
+    byParticipant, byStimulus = analyse(sessions, answers, args.jobs)
+    rows = list(byParticipant.rows("participant")) + list(byStimulus.rows("stimulus"))
+    fields = ["level", "id", "trials", "responses", "timeouts"]
+    fields += ["rt_mean", "rt_sd", "accuracy", "scored"]
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(out, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: _cell(v) for k, v in row.items()})
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Micro-benchmark for keyed access on `haptic.Data`.
+
+Compares the indexed `Data` container against the previous
+implementation, which scanned the list of tuples on every
+keyed read and write. Run from the repository root:
+
+    python benchmarks/data_index.py
+"""
+import os
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import mocks
+
+mocks.install()
+
+from haptic import Data
+
+
+class LinearData:
+    """The keyed access of `Data` before it was indexed."""
+
+    def __init__(self):
+        self.data = []
+
+    def __getitem__(self, index):
+        return [x[1] for x in self.data if x[0] == index][0]
+
+    def __setitem__(self, index, value):
+        match = [x for x in self.data if x[0] == index]
+        if len(match) == 0:
+            self.data.append((index, value))
+        else:
+            i = self.data.index(match[0])
+            self.data[i] = (index, value)
+
+
+def fill(cls, n):
+    d = cls()
+    for i in range(n):
+        d[f"trial{i}"] = i
+    return d
+
+
+def bench(cls, n, number=200):
+    """Seconds per keyed get and set on a container of `n` entries."""
+    d = fill(cls, n)
+    key = f"trial{n - 1}"  # Worst case for a linear scan
+    get = timeit.timeit(lambda: d[key], number=number) / number
+    set_ = timeit.timeit(lambda: d.__setitem__(key, 0), number=number) / number
+    return get, set_
+
+
+def main():
+    print(f"{'n':>7} {'impl':>7} {'get (us)':>10} {'set (us)':>10}")
+    for n in (100, 1000, 10000):
+        for name, cls in (("linear", LinearData), ("indexed", Data)):
+            get, set_ = bench(cls, n)
+            print(f"{n:>7} {name:>7} {get * 1e6:>10.2f} {set_ * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Measure ``import haptic`` and check that it stays lazy.
+
+Each measurement runs in a fresh interpreter. The script exits with
+status 1 if importing `haptic` also imported one of the heavy
+dependencies, or took longer than ``--max-ms``. From the repository
+root:
+
+    python benchmarks/import_time.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules `haptic` must only import on first use
+HEAVY = ("numpy", "evdev", "psychopy", "pyglet", "concurrent.futures")
+
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import haptic
+t = time.perf_counter() - t
+print(json.dumps({"seconds": t, "loaded": [m for m in %s if m in sys.modules]}))
+"""
+
+
+def measureImport(repeat=5):
+    """Best import time in seconds and the heavy modules it loaded."""
+    # The first run may have to write haptic's bytecode cache
+    runs = [_probe() for _ in range(repeat + 1)][1:]
+    loaded = sorted(set(m for r in runs for m in r["loaded"]))
+    return min(r["seconds"] for r in runs), loaded
+
+
+def _probe():
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE % repr(HEAVY)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-ms", type=float, default=200.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    seconds, loaded = measureImport(args.repeat)
+    print(f"import haptic: {seconds * 1000:.1f}ms")
+    status = 0
+    if loaded:
+        print(f"FAIL: import haptic also imported {', '.join(loaded)}")
+        status = 1
+    if seconds * 1000 > args.max_ms:
+        print(f"FAIL: import haptic took over {args.max_ms:.0f}ms")
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
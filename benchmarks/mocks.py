@@ -0,0 +1,136 @@
+"""Stand-ins for evdev and psychopy.
+
+Installing these lets `haptic` be imported and its hot paths timed
+on machines without a controller, a display or the native libraries
+those packages need. They do just enough to satisfy `haptic`; every
+hardware call is a no-op.
+"""
+import collections
+import os
+import sys
+import types
+
+ECODES = {
+    "EV_SYN": 0x00,
+    "EV_KEY": 0x01,
+    "EV_ABS": 0x03,
+    "EV_FF": 0x15,
+    "SYN_REPORT": 0,
+    "FF_RUMBLE": 0x50,
+    "ABS_X": 0x00,
+    "ABS_Y": 0x01,
+    "ABS_Z": 0x02,
+    "ABS_RX": 0x03,
+    "ABS_RY": 0x04,
+    "ABS_RZ": 0x05,
+}
+
+AbsInfo = collections.namedtuple("AbsInfo", "value min max fuzz flat resolution")
+
+
+class InputDevice:
+    """evdev.InputDevice backed by /dev/null."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = "mock"
+        self.fd = os.open(os.devnull, os.O_RDWR)
+        self.ff_effects_count = 16
+        self._lastEffect = -1
+
+    def capabilities(self, verbose=False, absinfo=True):
+        return {
+            ECODES["EV_KEY"]: list(range(304, 317)),
+            ECODES["EV_ABS"]: [
+                (c, AbsInfo(0, -32768, 32767, 0, 0, 0)) for c in range(6)
+            ],
+        }
+
+    def active_keys(self, verbose=False):
+        return []
+
+    def read(self):
+        raise BlockingIOError()
+
+    def write(self, etype, code, value):
+        pass
+
+    def upload_effect(self, effect):
+        self._lastEffect += 1
+        return self._lastEffect
+
+    def erase_effect(self, ff_id):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Joystick:
+    """psychopy.hardware.joystick.Joystick with a centred, idle pad."""
+
+    def __init__(self, id_=0):
+        self.id = id_
+        self.name = "mock"
+        self._device = types.SimpleNamespace(
+            device=types.SimpleNamespace(_filename=os.devnull, name="mock")
+        )
+
+    def getAllAxes(self):
+        return [0.0] * 6
+
+    def getAllButtons(self):
+        return [False] * 13
+
+    def getAllHats(self):
+        return [(0, 0)]
+
+
+class Stim:
+    """Any psychopy stimulus."""
+
+    def __init__(self, *args, **kwargs):
+        self.pos = (0.0, 0.0)
+        self.status = -1
+
+    def draw(self, win=None):
+        pass
+
+    def play(self, *args, **kwargs):
+        pass
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """Replace evdev and psychopy in ``sys.modules`` with the mocks."""
+    record = lambda name, fields: collections.namedtuple(name, fields)
+    ecodes = _module("evdev.ecodes", **ECODES)
+    ff = _module(
+        "evdev.ff",
+        Rumble=record("Rumble", "strong_magnitude weak_magnitude"),
+        Trigger=record("Trigger", "button interval"),
+        Replay=record("Replay", "length delay"),
+        EffectType=record("EffectType", "ff_rumble_effect"),
+        Effect=record("Effect", "type id direction trigger replay u"),
+    )
+    util = _module("evdev.util", list_devices=lambda *args: [])
+    _module("evdev", ecodes=ecodes, ff=ff, util=util, InputDevice=InputDevice)
+
+    joystick = _module("psychopy.hardware.joystick", Joystick=Joystick)
+    hardware = _module("psychopy.hardware", joystick=joystick)
+    sound = _module("psychopy.sound", Sound=Stim)
+    visual = _module(
+        "psychopy.visual",
+        ImageStim=Stim,
+        TextStim=Stim,
+        Circle=Stim,
+        BufferImageStim=Stim,
+    )
+    core = _module("psychopy.core")
+    _module("psychopy", hardware=hardware, sound=sound, visual=visual, core=core)
@@ -0,0 +1,225 @@
+"""Benchmark suite for the framework's hot paths.
+
+Runs without hardware: evdev and psychopy are replaced by the
+stand-ins in `mocks`, experiments draw to a `haptic.NullWindow`
+and read input from a `haptic.ReplayDevice`. Results are written
+as JSON so runs on different versions can be compared. From the
+repository root:
+
+    python benchmarks/run.py -o before.json
+    python benchmarks/run.py -o after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import import_time
+import mocks
+
+# Timed before the mocks are installed, in fresh interpreters
+IMPORT_TIME = import_time.measureImport()[0]
+
+mocks.install()
+
+import numpy as np
+
+import haptic
+
+
+def measure(func, number=None, repeat=5):
+    """Best seconds per call of `func` over `repeat` runs."""
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def benchData(sizes):
+    results = []
+    for n in sizes:
+        data = haptic.Data()
+        for i in range(n):
+            data[f"trial{i}"] = i
+        key = f"trial{n // 2}"
+        results.append(("data.get", {"n": n}, measure(lambda: data[key])))
+        results.append(
+            ("data.set", {"n": n}, measure(lambda: data.__setitem__(key, 0)))
+        )
+
+        def append():
+            data.append(0)
+            data.data.pop()
+
+        results.append(("data.append", {"n": n}, measure(append)))
+    return results
+
+
+def makeExperiment():
+    window = haptic.NullWindow()
+    device = haptic.ReplayDevice([([False] * 13, [0.0, 0.0, 0.0, 0.5, -0.5, 0.0])])
+
+    class Bench(haptic.Experiment):
+        def setJoystick(self):
+            pass
+
+    return Bench(window, joystick=device)
+
+
+def benchRun(frames):
+    experiment = makeExperiment()
+    noop = lambda frameN: ()
+    results = []
+    t = measure(lambda: experiment.run(frames, noop), number=1)
+    results.append(("run.frame", {"frames": frames}, t / frames))
+    experiment.instrument()
+    t = measure(lambda: experiment.run(frames, noop), number=1)
+    results.append(("run.frame.instrumented", {"frames": frames}, t / frames))
+    experiment.instrument(False)
+    timeline = experiment.compileTimeline(
+        haptic.Timeline(
+            [haptic.Phase("a", frames / 2 / experiment.frameRate), haptic.Phase("b")],
+            timeout=frames / experiment.frameRate,
+        )
+    )
+    t = measure(lambda: experiment.runTimeline(timeline), number=1)
+    results.append(("timeline.frame", {"frames": frames}, t / frames))
+    recorder = haptic.FrameRecorder(capacity=frames)
+
+    def recorded():
+        recorder.clear()
+        experiment.run(frames, noop, recorder=recorder)
+
+    t = measure(recorded, number=1)
+    results.append(("run.frame.recorded", {"frames": frames}, t / frames))
+    return results
+
+
+def benchStick(blocks):
+    experiment = makeExperiment()
+    results = [("stickPos", {}, measure(experiment.stickPos))]
+    processor = haptic.StickProcessor(invert=(False, True))
+    for n in blocks:
+        block = np.random.default_rng(0).uniform(-1, 1, (n, 6))
+        t = measure(lambda: processor(block))
+        results.append(("stick.block", {"n": n}, t / n))
+    return results
+
+
+def benchRumble():
+    device = haptic.HapticDevice()
+    capacity = device.effects.capacity
+    results = [("rumble.cached", {}, measure(device.rumble))]
+    mags = iter(range(1, 1 << 62))
+    results.append(
+        (
+            "setEffect.upload",
+            {"capacity": capacity},
+            measure(lambda: device._HapticDevice__setEffect(0, next(mags))),
+        )
+    )
+    return results
+
+
+def benchLayer():
+    # Draws are no-ops here, so this is the cost of checking the cache
+    stims = [mocks.Stim() for i in range(4)]
+    for stim in stims:
+        stim.pos = np.zeros(2)
+    layer = haptic.Layer(haptic.NullWindow(), stims)
+    return [("layer.draw", {"stims": len(stims)}, measure(layer.draw))]
+
+
+def benchEventLog(sizes):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "events.log")
+        log = haptic.EventLog(path)
+        append = measure(lambda: log.append(1.0, 3, 3, 7))
+        results.append(("eventLog.append", {}, append))
+        log.close()
+        for n in sizes:
+            path = os.path.join(tmp, f"events-{n}.log")
+            with haptic.EventLog(path, chunk=n) as log:
+                for i in range(n):
+                    log.append(i * 1e-3, 3, 3, i)
+            results.append(
+                ("eventLog.read", {"n": n}, measure(lambda: haptic.readEventLog(path)))
+            )
+    return results
+
+
+def metadata():
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        rev = None
+    return {
+        "revision": rev,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline):
+    old = {(r["name"], json.dumps(r["params"])): r["seconds"] for r in baseline}
+    print(f"{'benchmark':<28} {'params':<18} {'before':>10} {'after':>10} {'ratio':>7}")
+    for r in results:
+        before = old.get((r["name"], json.dumps(r["params"])))
+        if before is None:
+            continue
+        print(
+            f"{r['name']:<28} {json.dumps(r['params']):<18} "
+            f"{before * 1e6:>8.3f}us {r['seconds'] * 1e6:>8.3f}us "
+            f"{r['seconds'] / before:>7.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results to compare against")
+    parser.add_argument(
+        "--quick", action="store_true", help="smaller sizes, for a smoke test"
+    )
+    args = parser.parse_args(argv)
+
+    sizes = (100, 1000, 10000) if args.quick else (100, 1000, 10000, 100000, 1000000)
+    frames = 1000 if args.quick else 10000
+    blocks = (1, 1000) if args.quick else (1, 100, 10000)
+
+    raw = [("import.haptic", {}, IMPORT_TIME)]
+    raw += benchData(sizes) + benchRun(frames) + benchStick(blocks) + benchRumble()
+    raw += benchEventLog(sizes) + benchLayer()
+    results = [{"name": n, "params": p, "seconds": s} for n, p, s in raw]
+    for r in results:
+        print(
+            f"{r['name']:<28} {json.dumps(r['params']):<18} {r['seconds'] * 1e6:>10.3f}us"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": metadata(), "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print()
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 from psychopy import core, visual
-from psychopy.sound import Sound
-from haptic import Experiment, HapticDevice, Trial
+from haptic import Experiment, HapticDevice, TrajectoryBuffer
 
 
 class ExampleExperiment(Experiment):
@@ -52,7 +51,14 @@ class ExampleExperiment(Experiment):
         self.invert_y_axis = True  # Set config variable
 
         self.calibrate()  # Defined in the parent class
+
+        # Record every report from the right stick, not just the
+        # position once per frame that moves the cursor.
+        trajectory = TrajectoryBuffer(capacity=65536)
+        trajectory.attach(self.joystick)
         self.run(2000, self.mainLoop)
+        trajectory.detach()
+        self.log_data({"trajectory": trajectory.columns()})
         # Callback functions used in `run` calls should
         # generally be member functions as this allows
         # them to access the internal attributes and
@@ -77,18 +83,11 @@ class ExampleExperiment(Experiment):
         """`Experiment.__init__` looks for this method
         and will run its contents on initialization.
         """
+
         def makeButtons():
             buttonRet = {}
-            buttonImage = {
-                "north": "img/48px-PlayStation_button_T.png",
-                "south": "img/48px-PlayStation_button_X.png",
-                "east": "img/48px-PlayStation_button_C.png",
-                "west": "img/48px-PlayStation_button_S.png",
-            }
             for k, v in buttonImage.items():
-                i = visual.ImageStim(
-                    self.window, v, name=k.rstrip(".png").replace("_", " ")
-                )
+                i = self.assets.image(v, name=k.rstrip(".png").replace("_", " "))
                 buttonRet[k] = i
             buttonRet["east"].pos -= (0, 0.6)
             buttonRet["south"].pos -= (0, 0.1)
@@ -97,16 +96,25 @@ class ExampleExperiment(Experiment):
 
         def makeAudio():
             audioRet = {}
-            audioFiles = {
-                "one": "audio/speaker1.ogg",
-                "two": "audio/speaker2.ogg",
-                "three": "audio/speaker3.ogg"
-            }
             for k, v in audioFiles.items():
-                i = Sound(v, name=k)
+                i = self.assets.sound(v, name=k)
                 audioRet[k] = i
             return audioRet
 
+        buttonImage = {
+            "north": "img/48px-PlayStation_button_T.png",
+            "south": "img/48px-PlayStation_button_X.png",
+            "east": "img/48px-PlayStation_button_C.png",
+            "west": "img/48px-PlayStation_button_S.png",
+        }
+        audioFiles = {
+            "one": "audio/speaker1.ogg",
+            "two": "audio/speaker2.ogg",
+            "three": "audio/speaker3.ogg",
+        }
+        # Decode every file in parallel while the other stims are built
+        self.assets.prefetch(list(buttonImage.values()) + list(audioFiles.values()))
+
         cursor = visual.Circle(self.window, fillColor="blue", radius=0.01)
 
         calibrateRumbleText = visual.TextStim(
@@ -1,63 +1,80 @@
+import time
+
 from psychopy import core, visual
-from psychopy.sound import Sound
-from haptic import Experiment, HapticDevice, Trial
+from haptic import Experiment, HapticDevice, Phase, Timeline, Trial
 
 
 class LexDecTrial(Trial):
-    def __init__(self, audioObj, num, exp):
-        self.stim = audioObj
-        super().__init__(audioObj.name, num, exp)
+    def __init__(self, name, path, num, exp):
+        self.path = path
+        self.stim = None
+        super().__init__(name, num, exp)
         self.data["timing"] = {}
         self.response_card = self.experiment.response_card
         self.fixation_cross = self.experiment.fixation_cross
         self.left_response = "word"
         self.right_response = "nonword"
 
+    def prepare(self):
+        """Decode the audio while the previous trial runs."""
+        self.experiment.assets.get(self.path)
+        super().prepare()
+
+    def release(self):
+        self.stim = None
+
     def fire(self, dur=5, delay=1):
-        def drawScenes(frameN, *args, **kwargs):
-            if frameN >= fps * delay and frameN < fps * dur:
-                if self.stim.status == "FINISHED" or self.stim.status == -1:
-                    try:
-                        assert self.data["timing"]["play_stop"]
-                    except KeyError:
-                        self.data["timing"]["play_stop"] = frameN
-                    return self.response_card
-            elif frameN >= fps * dur:
-                self.data["timing"]["response"] = frameN
-                self.data["data"]["response"] = "NA"
-                raise StopIteration()
-            return self.fixation_cross
-
-        def playStim(frameN):
-            def responseListener(frameN):
-                pressed = self.experiment.joystick.getAllButtons()
-                if True in pressed:
-                    if pressed[3]:
-                        self.data["timing"]["response"] = frameN
-                        self.data["data"]["response"] = self.left_response
-                        raise StopIteration()
-                    elif pressed[1]:
-                        self.data["timing"]["response"] = frameN
-                        self.data["data"]["response"] = self.right_response
-                        raise StopIteration()
-                return
-
-            if frameN == fps * delay:
-                self.data["timing"]["play_start"] = frameN
-                self.stim.play()
-            else:
-                responseListener(frameN)
-
-        fps = 60  # Should probably be tied to experiment monitor
-        self.experiment.on_run_loop = playStim
-        self.experiment.run(600, drawScenes)
-        self.experiment.on_run_loop = lambda: None
+        def finished():
+            return self.stim.status == "FINISHED" or self.stim.status == -1
+
+        # Built from the samples prepare() left in the asset cache
+        self.stim = self.experiment.assets.sound(self.path, name=self.name)
+        responses = {3: self.left_response, 1: self.right_response}
+        timeline = Timeline(
+            [
+                Phase("fixation", delay, draw=[self.fixation_cross], mark=None),
+                Phase(
+                    "stimulus",
+                    draw=[self.fixation_cross],
+                    responses=responses,
+                    until=finished,
+                    # Start the audio on the flip its onset is stamped at
+                    onFlip=self.stim.play,
+                    mark="play_start",
+                ),
+                Phase(
+                    "response_card",
+                    draw=self.response_card,
+                    responses=responses,
+                    mark="play_stop",
+                ),
+            ],
+            timeout=dur,
+        )
+        self.startTrajectory()
+        self.experiment.runTimeline(
+            self.experiment.compileTimeline(timeline), self, recorder=self.samples
+        )
+        self.stopTrajectory()
+        self.data["data"]["rt"] = self.reactionTime("play_start")
+        if self.experiment.frameTimer is not None:
+            self.data["frame_timing"] = self.experiment.runTiming
+        self.data["samples"] = self.samples.columns()
         print(self.data)
+        return self.data
 
 
 class LexDecExperiment(Experiment):
-    def __init__(self):
-        """Create an experiment."""
+    def __init__(self, win=None, **kwargs):
+        """Create an experiment.
+
+        Keyword arguments:
+          win (psychopy.visual.Window): The window to run in.
+            Defaults to a new 400x400 window.
+
+        Other keyword arguments are passed to `Experiment`; give
+        a `ReplayDevice` as `joystick` to run without a controller.
+        """
 
         def makeTrials():
             trials = []
@@ -65,13 +82,16 @@ class LexDecExperiment(Experiment):
             print(audioStims)
             i = 0
             for k, v in audioStims.items():
-                t = LexDecTrial(v, i, self)
+                t = LexDecTrial(k, v, i, self)
                 trials.append(t)
                 i += 1
             self.trials = trials
 
-        win = visual.Window([400, 400])  # Create the window
-        super().__init__(win)  # Initialize the parent class
+        if win is None:
+            win = visual.Window([400, 400])  # Create the window
+        if "datafile" not in kwargs:
+            kwargs["datafile"] = time.strftime("data/lexdec-%Y%m%d-%H%M%S.jsonl")
+        super().__init__(win, **kwargs)  # Initialize the parent class
 
         self.invert_y_axis = True  # Set config variable
 
@@ -81,31 +101,33 @@ class LexDecExperiment(Experiment):
         buttons["south"].pos -= (0, 0.1)
         buttons["west"].pos -= (0, 0.2)
         self.stims["buttons"] = buttons
+        self.stims["calibrateRumbleLayer"].refresh()
+        self.stims["calibrateStickLayer"].refresh()
         self.calibrate()  # Defined in the parent class
         # self.run(2000, self.mainLoop)
         self.makeTrialCard()
         makeTrials()
         self.checkHold()
-        for trial in self.trials:
-            trial.fire()
-            self.data.append(trial.data)
-            del trial
-        print(self.data)
+        # Each trial's audio is decoded while the one before it runs
+        self.runTrials(self.trials)
+        self.writer.close()
 
     def calibrateRumbleDisplay(self):
         """`Experiment.calibrate` looks for this method
         and will run its contents on every window flip.
         """
-        self.stims["calibrateRumbleText"].draw()
-        self.stims["buttons"]["south"].draw()
-        self.stims["buttons"]["east"].draw()
+        self.stims["calibrateRumbleLayer"].draw()
 
     def calibrateStickDisplay(self):
         """`Experiment.calibrate` looks for this method
         and will run its contents on every window flip.
         """
-        self.stims["calibrateStickText"].draw()
-        self.stims["buttons"]["west"].draw()
+        self.stims["calibrateStickLayer"].draw()
+
+    def setJoystick(self):
+        """Read the controller on its own thread so responses
+        carry the kernel's event timestamps."""
+        self.joystick = HapticDevice(threaded=True)
 
     def runBlock(self):
         for trial in self.trials:
@@ -114,30 +136,25 @@ class LexDecExperiment(Experiment):
     def makeStims(self):
         def makeButtons():
             buttonRet = {}
-            buttonImage = {
-                "north": "img/48px-PlayStation_button_T.png",
-                "south": "img/48px-PlayStation_button_X.png",
-                "east": "img/48px-PlayStation_button_C.png",
-                "west": "img/48px-PlayStation_button_S.png",
-            }
             for k, v in buttonImage.items():
-                i = visual.ImageStim(
-                    self.window, v, name=k.rstrip(".png").replace("_", " ")
-                )
+                i = self.assets.image(v, name=k.rstrip(".png").replace("_", " "))
                 buttonRet[k] = i
             return buttonRet
 
-        def makeAudio():
-            audioRet = {}
-            audioFiles = {
-                "one": "audio/speaker1.ogg",
-                "two": "audio/speaker2.ogg",
-                "three": "audio/speaker3.ogg",
-            }
-            for k, v in audioFiles.items():
-                i = Sound(v, name=k)
-                audioRet[k] = i
-            return audioRet
+        buttonImage = {
+            "north": "img/48px-PlayStation_button_T.png",
+            "south": "img/48px-PlayStation_button_X.png",
+            "east": "img/48px-PlayStation_button_C.png",
+            "west": "img/48px-PlayStation_button_S.png",
+        }
+        audioFiles = {
+            "one": "audio/speaker1.ogg",
+            "two": "audio/speaker2.ogg",
+            "three": "audio/speaker3.ogg",
+        }
+        # Decode the images in parallel while the other stims are built;
+        # each trial decodes its own audio just before it is needed
+        self.assets.prefetch(buttonImage.values())
 
         cursor = visual.Circle(self.window, fillColor="blue", radius=0.01)
 
@@ -158,12 +175,21 @@ class LexDecExperiment(Experiment):
         self.stims = {
             "cursor": cursor,
             "buttons": makeButtons(),
-            "audio": makeAudio(),
+            "audio": audioFiles,
             "responseText": response_text,
             "calibrateRumbleText": calibrateRumbleText,
             "calibrateStickText": calibrateStickText,
         }
 
+        buttons = self.stims["buttons"]
+        # Each screen is blitted from one image; moving a stim recaptures it
+        self.stims["calibrateRumbleLayer"] = self.layer(
+            [calibrateRumbleText, buttons["south"], buttons["east"]]
+        )
+        self.stims["calibrateStickLayer"] = self.layer(
+            [calibrateStickText, buttons["west"]]
+        )
+
         self.fixation_cross = visual.TextStim(self.window, text="+")
 
     def makeTrialCard(self, x_offset=0.5, y_offset=0.2):
@@ -184,7 +210,10 @@ class LexDecExperiment(Experiment):
         responseText[0].pos += text_offset
         responseText[1].pos += right_offset
         responseText[1].pos += text_offset
-        self.response_card = [responseText[0], responseText[1], square, circle]
+        card = self.layer([responseText[0], responseText[1], square, circle])
+        # Capture now, not on the frame that marks play_stop
+        card.refresh()
+        self.response_card = [card]
 
 
 if __name__ == "__main__":
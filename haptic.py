@@ -1,32 +1,126 @@
-from evdev import ecodes, ff, InputDevice, util
-from numpy import subtract
-from psychopy.hardware import joystick
-from psychopy.sound import Sound
-from psychopy import core, visual
+import atexit
+import collections
+import csv
+import fcntl
+import hashlib
+import importlib
+import io
+import json
+import math
+import mmap
+import os
+import queue
+import selectors
+import struct
+import threading
+import time
 
 
-class HapticDevice(joystick.Joystick, InputDevice):
+class _LazyModule:
+    """Placeholder for a module that is imported on first use.
+
+    The first attribute lookup imports the module and rebinds the
+    module-level name to it, so later lookups go straight to the
+    real module. This keeps ``import haptic`` free of psychopy,
+    evdev and NumPy, which are slow to import and need native
+    libraries, until something actually uses them.
+    """
+
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+asyncio = _LazyModule("asyncio", "asyncio")
+futures = _LazyModule("concurrent.futures", "futures")
+evdev = _LazyModule("evdev", "evdev")
+ecodes = _LazyModule("evdev.ecodes", "ecodes")
+ff = _LazyModule("evdev.ff", "ff")
+np = _LazyModule("numpy", "np")
+joystick = _LazyModule("psychopy.hardware.joystick", "joystick")
+sound = _LazyModule("psychopy.sound", "sound")
+visual = _LazyModule("psychopy.visual", "visual")
+
+
+def __getattr__(name):
+    """Create classes that subclass psychopy or evdev on first use."""
+    try:
+        define = _LAZY_CLASSES[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    cls = globals()[name] = define()
+    return cls
+
+
+def _lazyClass(name):
+    """Get a class created by `__getattr__` from inside the module."""
+    try:
+        return globals()[name]
+    except KeyError:
+        return __getattr__(name)
+
+
+class _HapticDevice:
     """Manage calibration and use of a haptic device.
 
+    The class is created, subclassing psychopy's ``Joystick`` and
+    evdev's ``InputDevice``, the first time ``haptic.HapticDevice``
+    is used, which is when those packages are imported.
+
     Attributes:
       name (string): System-provided name for the device.
       id (int): Index of device in pyglet's list.
-      effect (evdev.ff.Effect): Main evdev force effect.
-      effect_id (int?): The ID of the effect uploaded to the device.
+      effects (EffectPool): Rumble effects uploaded to the device.
       offset (tuple): How much to offset inputs from the joysticks.
       strongMagnitude (int): Vibration strength for the strong motor
       weakMagnitude (int): Vibration strength for the weak motor
+      events (collections.deque): The most recent evdev events read
+        while the background reader is running. See `startReader`.
+      group (DeviceGroup): The group reading the device's events, or
+        None while it uses pyglet's state.
+      connected (bool): False once a `DeviceGroup` has found the
+        controller unplugged. A device that is only read through
+        pyglet, with no reader, is never found unplugged and stays
+        True. See `reattach`.
+      listeners (tuple): Callables passed every event read. See
+        `addListener`.
+      eventLog (EventLog): Where the device's events are logged, or
+        None. See `logEvents`.
+      monotonicEvents (bool): Whether the kernel timestamps this
+        device's events on the monotonic clock. If not, `eventTime`
+        moves them onto it with an offset taken when the device
+        was opened.
     """
 
     strongMagnitude = 0x0000
     weakMagnitude = 0xFFF0
+    offset = None
+    connected = True
+    group = None
+    _clockOffset = 0.0
+    listeners = ()
+    eventLog = None
+    _reader = None
+    _sequencer = None
+
+    # pyglet exposes these absolute axes, in this order, as a
+    #  joystick's x, y, z, rx, ry and rz.
+    _AXIS_CODES = (0, 1, 2, 3, 4, 5)  # ABS_X through ABS_RZ
+    _EVIOCSCLOCKID = 0x400445A0  # _IOW('E', 0xa0, int)
 
-    def __init__(self, id_=0, dev=None):
+    def __init__(self, id_=0, dev=None, threaded=False):
         """Creates a HapticDevice derived from evdev and psychopy
 
         Keyword arguments:
           id_ (int): ID of device in pyglet's list.
           dev (string): Path to the /dev device.
+          threaded (bool): Start the background evdev reader.
+            See `startReader`.
 
         Raises:
           ValueError: If the device specified by `dev` cannot
@@ -39,19 +133,79 @@ class HapticDevice(joystick.Joystick, InputDevice):
             # Close the parent device and replace
             #  it with the specified device
             self._device.close()  # From joystick.Joystick
-            devices = joystick.pyglet_input.get_inputs()  # Assumes we're using pyglet
-            devMatch = [d for d in devices if d.device._filename == dev]
-            if len(devMatch) > 1:
-                raise ValueError(f"Multiple devices found for {dev}")
-            elif len(devMatch) == 0:
-                raise ValueError(f"No device found at {dev}")
-            self.id = devices.index(devMatch[0])
-            self._device = devMatch[0]
-            self._device.open()
-            self.name = self._device.device.name
-
-        self._filename = self._device.device._filename
-        InputDevice.__init__(self, self._filename)
+            self._openPyglet(dev)
+
+        self._openEvdev(self._device.device._filename)
+        if threaded:
+            self.startReader()
+
+    def _openPyglet(self, path, registry=None):
+        if registry is None:
+            registry = DeviceRegistry.default()
+        self.id, self._device = registry.pygletInput(path)
+        self._device.open()
+        self.name = self._device.device.name
+
+    def _openEvdev(self, path):
+        self._filename = path
+        evdev.InputDevice.__init__(self, path)
+        self.effects = EffectPool(self)
+        self._useMonotonicClock()
+        self.connected = True
+
+    def reattach(self, timeout=0, registry=None):
+        """Reopen the controller after it was unplugged.
+
+        The controller is found again by its uniq (usually a
+        Bluetooth address) or, failing that, by its phys and name,
+        so it may come back at a different path. Its offset and
+        magnitudes are kept, its effects are uploaded again as they
+        are next used, and if it was in a `DeviceGroup` it is read
+        by the group again.
+
+        Nothing calls this automatically. While the device is read,
+        waits on it raise `ConnectionError` once it is unplugged and
+        `DeviceGroup.onDisconnect` is called from the reading thread;
+        catch the error, or note the callback, and reattach from the
+        experiment's thread. Without a reader the unplug is not seen.
+
+        Keyword arguments:
+          timeout (float): Seconds to wait for the controller to
+            reappear.
+          registry (DeviceRegistry): Registry to search. Defaults
+            to the shared registry.
+
+        Returns:
+          True if the controller was reattached.
+        """
+        if registry is None:
+            registry = DeviceRegistry.default()
+        deadline = time.monotonic() + timeout
+        while True:
+            registry.refresh()
+            if self.uniq:
+                matches = registry.find(uniq=self.uniq)
+            else:
+                matches = registry.find(name=self.name, phys=self.phys)
+            if matches:
+                break
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+
+        group = self.group
+        if group is not None:
+            group._drop(self)
+        for close in (self._device.close, lambda: evdev.InputDevice.close(self)):
+            try:
+                close()
+            except OSError:
+                pass
+        self._openPyglet(matches[0].path, registry)
+        self._openEvdev(matches[0].path)
+        if group is not None:
+            group._rejoin(self)
+        return True
 
     def calibrateRumble(
         self,
@@ -79,292 +233,3666 @@ class HapticDevice(joystick.Joystick, InputDevice):
         if sMag <= 0 and wMag <= 0:
             raise ValueError("Rumble cannot be zero")
         self.__setEffect(sMag, wMag)
-        self.rumble()
+        self.rumble(sMag=sMag, wMag=wMag)
 
-    def calibrateStick(self, win, display=None, displayArgs=[]):
+    def calibrateStick(self, win, display=None, displayArgs=[], frames=60):
         """Calibrate the stick's resting position.
 
         Currently, the procedure is to move the right stick around, release,
           and press the West button (square on PS, X on MS). Future
           implementations may support other sticks or specified buttons
 
+        After the press the resting axes are sampled for `frames`
+          more frames and the offset is their mean, so a single noisy
+          reading does not set it for the whole session.
+
         Arguments:
           win (psychopy.visual.Window): The window being used by the experiment.
             This is needed because the joystick's input is only updated on
             screen flip.
+
+        Keyword arguments:
+          frames (int): Frames to sample the resting stick for. With
+            0 the offset is the reading when the button is pressed.
+
+        Returns:
+          A `RunningStats` of the resting axes, whose `std` is the
+          noise on each axis.
         """
 
-        while True:
-            stickPos = tuple(joystick.Joystick.getAllAxes(self))
+        def show():
             try:
                 display(*displayArgs)
             except TypeError:
                 pass
-            if self.getAllButtons()[3] == True:
-                # print(stickPos)
-                self.offset = stickPos
-                break
+
+        stats = RunningStats(len(self._rawAxes()))
+        show()
+        win.flip()
+        self.waitForButton((3,))
+        win.flip()
+        stats.add(self._rawAxes())
+        for _ in range(frames):
             win.flip()
+            show()
+            stats.add(self._rawAxes())
+        self.setOffset(stats.mean)
+        return stats
 
     def getAllAxes(self):
         """Get input from all sticks, minus offset if possible"""
+        axes = self._rawAxes()
+        if self.offset is None:
+            return axes
+        return np.subtract(axes, self.offset)
+
+    def getAllButtons(self):
+        """Get the state of all buttons.
+
+        Reads the background reader's snapshot while it runs,
+        otherwise pyglet's state as of the last window flip.
+        """
+        if self.group is not None:
+            return list(self._snapshot[0])
+        return joystick.Joystick.getAllButtons(self)
+
+    def getButtonTimes(self):
+        """Get the kernel timestamp of each button's last change.
+
+        Timestamps are seconds on the monotonic clock, the same
+        clock as ``time.monotonic()``, and are only tracked while
+        the background reader runs. Buttons that have not changed
+        since, or when the reader is not running, are None.
+        """
+        if self.group is not None:
+            return self._snapshot[2]
+        return (None,) * len(self.getAllButtons())
+
+    def waitForInput(self, condition=None, timeout=None):
+        """Block until the device's input meets a condition.
+
+        The calling thread sleeps on the device's file descriptor,
+        or on its `DeviceGroup`'s thread, and the condition is only
+        checked when a report arrives, so waiting costs no CPU and
+        needs no window flips. A device that is not being read is
+        read for the duration of the wait; pyglet's own state is
+        unaffected.
+
+        Keyword arguments:
+          condition (function): Called with the device; the wait
+            ends when it returns anything but None. Defaults to
+            waiting for the next report of any input.
+          timeout (float): Seconds to wait, or None for no limit.
+
+        Returns:
+          The value returned by `condition`, or None on timeout.
+
+        Raises:
+          ConnectionError: The device is or becomes unplugged.
+        """
+        if not self.connected:
+            raise ConnectionError(f"{self.path} is unplugged")
+        if condition is None:
+            start = self._reports
+
+            def condition(device):
+                return True if device._reports != start else None
+
+        def check():
+            if not self.connected:
+                raise ConnectionError(f"{self.path} was unplugged")
+            return condition(self)
+
+        group = self.group
+        temporary = group is None
+        if temporary:
+            group = DeviceGroup([self])
+        try:
+            return group._waitFor(check, timeout)
+        finally:
+            if temporary:
+                group.close()
+
+    def waitForButton(self, buttons=None, timeout=None):
+        """Block until a button is pressed.
+
+        Keyword arguments:
+          buttons (iterable): Button indices to wait for. Defaults
+            to any button.
+          timeout (float): Seconds to wait, or None for no limit.
+
+        Returns:
+          The index of the pressed button, or None on timeout.
+
+        Raises:
+          ConnectionError: The device is or becomes unplugged.
+        """
+        return self.waitForInput(_pressed(buttons), timeout)
+
+    def waitForRelease(self, timeout=None):
+        """Block until no button is held.
+
+        Returns:
+          True once every button is released, or None on timeout.
+
+        Raises:
+          ConnectionError: The device is or becomes unplugged.
+        """
+        return self.waitForInput(_released, timeout)
+
+    def startReader(self, bufferSize=4096, loop=None):
+        """Read the device's evdev events on a background thread.
+
+        While the reader runs, `getAllButtons` and `getAllAxes`
+        return the state built from the device's own event stream,
+        updated at the controller's report rate, instead of pyglet's
+        state which only changes when the window flips. Buttons and
+        axes keep pyglet's ordering and axes its [-1, 1] scaling.
+
+        The state is published as a single tuple on every
+        ``SYN_REPORT``, so readers never take a lock and never see
+        a half-applied report.
+
+        Keyword arguments:
+          bufferSize (int): Number of recent events kept in `events`.
+          loop (asyncio.AbstractEventLoop): Read the events from this
+            event loop instead of a thread. See `DeviceGroup.attach`.
+        """
+        if self.group is not None:
+            return
+        self._reader = DeviceGroup([self], bufferSize=bufferSize)
+        if loop is None:
+            self._reader.start()
+        else:
+            self._reader.attach(loop)
+
+    def stopReader(self):
+        """Stop the background reader and return to pyglet's state."""
+        if self._reader is None:
+            return
+        self._reader.close()
+        self._reader = None
+
+    def _initState(self, bufferSize=4096):
+        """Build the event-driven state from the device's current state."""
+        caps = self.capabilities(absinfo=True)
+        # pyglet numbers buttons in ascending key code order
+        self._buttonIndex = {
+            code: i for i, code in enumerate(sorted(caps.get(ecodes.EV_KEY, [])))
+        }
+        self._buttons = [False] * len(self._buttonIndex)
+        self._buttonTimes = [None] * len(self._buttonIndex)
+        for code in self.active_keys():
+            if code in self._buttonIndex:
+                self._buttons[self._buttonIndex[code]] = True
+
+        self._axes = [0.0] * len(self._AXIS_CODES)
+        self._axisScale = {}
+        for code, info in caps.get(ecodes.EV_ABS, []):
+            if code in self._AXIS_CODES and info.max > info.min:
+                scale = 2.0 / (info.max - info.min)
+                bias = -info.min * scale - 1.0
+                self._axisScale[code] = (scale, bias)
+                self._axes[self._AXIS_CODES.index(code)] = info.value * scale + bias
+
+        self.events = collections.deque(maxlen=bufferSize)
+        self._reports = 0
+        self._publish()
+
+    def _drainEvents(self):
+        """Process every event waiting on the device."""
+        try:
+            for event in self.read():
+                self._processEvent(event)
+                for listener in self.listeners:
+                    listener(event)
+        except BlockingIOError:
+            pass
+
+    def addListener(self, listener):
+        """Call `listener` with every evdev event read from the device.
+
+        Listeners are called on the thread reading the events, after
+        the device's own state has been updated for the event, so on
+        ``SYN_REPORT`` the snapshot holds the complete report. They
+        only see events while the device is read by a `DeviceGroup`
+        or `startReader`, and must return quickly.
+        """
+        self.listeners = self.listeners + (listener,)
+
+    def removeListener(self, listener):
+        """Stop calling a listener added with `addListener`."""
+        self.listeners = tuple(f for f in self.listeners if f is not listener)
+
+    def logEvents(self, log):
+        """Log every event read from and every ``EV_FF`` event
+        written to the device, starting its reader if it is not
+        already being read.
+
+        Arguments:
+          log (EventLog): The log to write to, or None to stop.
+        """
+        if self.eventLog is not None:
+            self.removeListener(self.eventLog)
+        self.eventLog = log
+        if log is None:
+            return
+        if self.group is None:
+            self.startReader()
+        self.addListener(log)
+
+    def write(self, etype, code, value):
+        """Write an event to the device, logging it if `logEvents`
+        is on."""
+        evdev.InputDevice.write(self, etype, code, value)
+        log = self.eventLog
+        if log is not None:
+            log.append(time.monotonic(), etype, code, value)
+
+    def _processEvent(self, event):
+        self.events.append(event)
+        if event.type == ecodes.EV_KEY:
+            try:
+                i = self._buttonIndex[event.code]
+            except KeyError:
+                return
+            self._buttons[i] = event.value != 0
+            self._buttonTimes[i] = self.eventTime(event)
+        elif event.type == ecodes.EV_ABS:
+            try:
+                scale, bias = self._axisScale[event.code]
+            except KeyError:
+                return
+            self._axes[self._AXIS_CODES.index(event.code)] = event.value * scale + bias
+        elif event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+            self._publish()
+
+    def _publish(self):
+        self._reports += 1
+        self._snapshot = (
+            tuple(self._buttons),
+            tuple(self._axes),
+            tuple(self._buttonTimes),
+        )
+
+    def _useMonotonicClock(self):
+        """Have the kernel stamp this device's events with
+        CLOCK_MONOTONIC instead of the wall clock."""
         try:
-            return subtract(joystick.Joystick.getAllAxes(self), self.offset)
-        except:
-            return joystick.Joystick.getAllAxes(self)
+            fcntl.ioctl(
+                self.fd, self._EVIOCSCLOCKID, struct.pack("i", time.CLOCK_MONOTONIC)
+            )
+        except OSError:
+            # Kernels before 3.4; event times stay on the wall clock
+            self.monotonicEvents = False
+            self._clockOffset = time.time() - time.monotonic()
+        else:
+            self.monotonicEvents = True
+            self._clockOffset = 0.0
+
+    def eventTime(self, event):
+        """The time of an evdev event on the monotonic clock.
+
+        Arguments:
+          event (evdev.InputEvent): An event read from this device.
+        """
+        return event.sec + event.usec * 1e-6 - self._clockOffset
+
+    def _rawAxes(self):
+        """All axes without the offset applied."""
+        if self.group is not None:
+            return list(self._snapshot[1])
+        return joystick.Joystick.getAllAxes(self)
 
     def getHat(self, n):
         "Get the d-pad input. Not currently used"
         return self.getAllHats()[n]
 
-    def rumble(self, repeat=1):
+    def rumble(self, repeat=1, sMag=None, wMag=None, duration=100):
         """Cause the device to rumble.
 
+        The effect is taken from `effects`, so rumbling at
+        magnitudes that were used recently is a single write
+        to the device.
+
         Keyword arguments:
-            repeat (int): How long the device should rumble for, in seconds
+            repeat (int): How many times to play the effect.
+            sMag (int): Strong motor magnitude. Defaults to
+              `strongMagnitude`.
+            wMag (int): Weak motor magnitude. Defaults to
+              `weakMagnitude`.
+            duration (int): Length of the effect in milliseconds.
         """
-        try:
-            self.write(ecodes.EV_FF, self.effect_id, repeat)
-        except AttributeError:
-            self.effect_id = self.upload_effect(self.effect)
-            self.rumble()
+        if sMag is None:
+            sMag = self.strongMagnitude
+        if wMag is None:
+            wMag = self.weakMagnitude
+        self.write(ecodes.EV_FF, self.effects.get(sMag, wMag, duration), repeat)
+
+    def playPattern(self, pattern, start=None):
+        """Play a rumble pattern without blocking.
+
+        The pattern is queued on the device's `HapticSequencer`,
+        created on first use. See `HapticSequencer.play`.
+
+        Returns:
+          The `RumblePlayback` for the pattern.
+        """
+        if self._sequencer is None:
+            self._sequencer = HapticSequencer(self)
+        return self._sequencer.play(pattern, start)
 
     def setMagnitudes(self, sMag, wMag):
         self.strongMagnitude = sMag
         self.weakMagnitude = wMag
 
     def setOffset(self, offset):
+        """Set the resting position subtracted from all axes.
+
+        Raises:
+          ValueError: If `offset` is not one value per axis.
+        """
+        offset = np.asarray(offset, dtype=float)
+        if offset.ndim != 1:
+            raise ValueError(f"Offset must be one value per axis, got {offset}")
         self.offset = offset
 
     def __setEffect(self, sMag, wMag, duration=100):
-        try:
-            print(self.effect_id)
-            self.erase_effect(self.effect_id)
-            del self.effect_id
-        except AttributeError:
-            pass
+        """Make sure the effect for these magnitudes is uploaded."""
+        self.effects.get(sMag, wMag, duration)
 
-        rumble = ff.Rumble(strong_magnitude=sMag, weak_magnitude=wMag)
-        self.effect = ff.Effect(
-            ecodes.FF_RUMBLE,
-            -1,
-            0,
-            ff.Trigger(0, 0),
-            ff.Replay(duration, 0),
-            ff.EffectType(ff_rumble_effect=rumble),
-        )
 
+def _defineHapticDevice():
+    return type(
+        "HapticDevice",
+        (_HapticDevice, joystick.Joystick, evdev.InputDevice),
+        {"__doc__": _HapticDevice.__doc__, "__module__": __name__},
+    )
 
-class Experiment:
-    """Experiment objects control the flow of an experiment and
-    serve as an abstraction layer above the hardware and
-    graphics managment layers. It is set up to primarily use
-    callback methods allowing external definition of processes
-    without requiring (but still allowing) management of the
-    execution chain.
 
-    The best way to use this is by extending the class, creating
-    a child experiment and overwriting methods where needed.
+_LAZY_CLASSES = {"HapticDevice": _defineHapticDevice}
 
-    Attributes:
-      window (psychopy.visual.window): The psychopy window in
-        use for this experiment.
-      joystick (HapticDevice): The joystick in use.
-      stims: Will be set to the output of the `makeStims`
-        callback. See `makeStims`.
-      invert_y_axis (bool): Whether the stick position's y-axis
-        should be inverted by default.
+
+def rumbleEffect(sMag, wMag, duration=100):
+    """Build an evdev rumble effect ready to be uploaded.
+
+    Arguments:
+      sMag (int): Strength of strong motor vibration.
+      wMag (int): Strength of weak motor vibration.
+
+    Keyword arguments:
+      duration (int): Length of the effect in milliseconds.
     """
+    rumble = ff.Rumble(strong_magnitude=sMag, weak_magnitude=wMag)
+    return ff.Effect(
+        ecodes.FF_RUMBLE,
+        -1,
+        0,
+        ff.Trigger(0, 0),
+        ff.Replay(duration, 0),
+        ff.EffectType(ff_rumble_effect=rumble),
+    )
 
-    def __init__(self, w, **kwargs):
-        """Create an Experiment object
 
-        Arguments:
-          w (psychopy.visual.Window): the psychopy window to use
-            for this experiment
+class EffectPool:
+    """Rumble effects kept uploaded to a device.
 
-        Keyword arguments:
-          joystick (HapticDevice, optional): The joystick to
-            send haptic events to.
-          stims (function): A callback function used to make the
-            stimuli on initialization. The function will be passed
-            the `window` attribute as the first argument and then
-            the arguments in `stimargs` and `stimkwargs`.
-          stimargs (list): Arguments to pass to the `stims` callback.
-          stimkwargs (dictionary): Keyword arguments to pass to the
-            `stims` callback.
-        """
-        self.data = Data()
-        self.window = w
-        self.makeStims()
-        self.setJoystick()
-        try:
-            self.invert_y_axis = kwargs["invertaxis"]
-        except KeyError:
-            self.invert_y_axis = False
+    Effects are keyed by ``(strong, weak, duration)``. Once an
+    effect is uploaded it stays on the device, so playing it again
+    only needs an ``EV_FF`` write. When the device's effect memory
+    is full, the least recently used effect is erased to make room.
+    Effects that are `pin`ned, such as those of a pattern being
+    played, are never erased.
 
-    def makeStims(self):
-        """Overwrite with own function."""
-        pass
+    The pool is safe to use from several threads.
 
-    def setJoystick(self):
-        """Creates default joystick, can overwrite with own function."""
-        self.joystick = HapticDevice()
+    Attributes:
+      device (evdev.InputDevice): The device effects are uploaded to.
+      capacity (int): How many effects may be uploaded at once.
+    """
 
-    def calibrate(self, *args, **kwargs):
-        """Runs the joystick calibration methods.
+    def __init__(self, device, capacity=None):
+        """Create an empty pool.
 
-        Warning:
-          This should be considered highly unstable.
-            Its operation will be changed to accomodate changes in
-            the `haptic.HapticDevice` calibration scheme providing
-            a relatively seamless integration of calibration
-            into main experiment files.
+        Arguments:
+          device (evdev.InputDevice): The device to upload to.
 
         Keyword arguments:
-          sMag (int): Strong motor magnitude.
-          wMag (int): Weak motor magnitude.
-          step (int): How much to step up the magnitude.
+          capacity (int): Maximum number of uploaded effects.
+            Defaults to the number the device reports it can hold
+            (``EVIOCGEFFECTS``).
         """
+        if capacity is None:
+            capacity = getattr(device, "ff_effects_count", 1)
+        self.device = device
+        self.capacity = max(capacity, 1)
+        self._effects = collections.OrderedDict()
+        self._pinned = {}  # key -> number of pins
+        self._lock = threading.Lock()
 
-        def calibrateRumble(sMag, wMag):
-            """Interactive calibration of vibration strength
+    def get(self, sMag, wMag, duration=100):
+        """Get the ID of an uploaded effect, uploading it if needed.
 
-            The vibration strength starts at wMag and ticks
-            up by 0x0f00 until the user presses the south button
-            on the controller (e.g., x on dualshock). Pressing
-            the east button progresses the calibration.
+        Raises:
+          RuntimeError: If the pool is full of pinned effects.
+        """
+        with self._lock:
+            return self._get((sMag, wMag, duration))
 
-            Raises:
-              ValueError: Both motors may not be set to zero.
-            """
-            if sMag <= 0 and wMag <= 0:
-                raise ValueError("Rumble cannot be zero")
+    def pin(self, keys):
+        """Upload effects and keep them uploaded until `unpin`.
 
-            self.joystick.calibrateRumble(sMag, wMag)
-            print(wMag)
-            while True:
-                self.calibrateRumbleDisplay()
-                buttons = self.joystick.getAllButtons()
-                if buttons[0]:
-                    self.joystick.setMagnitudes(sMag, wMag)
-                    return
-                elif buttons[1]:
-                    while True:
-                        if not self.joystick.getAllButtons()[1]:
-                            self.run(50, self.calibrateRumbleDisplay)
-                            break
-                        self.run(1, self.calibrateRumbleDisplay)
-                    calibrateRumble(sMag, wMag + 0x0F00)
-                self.window.flip()
+        Arguments:
+          keys (list): ``(sMag, wMag, duration)`` of each effect.
 
-        def calibrateStick():
-            """Calibrate the stick's resting position.
+        Returns:
+          The ID of each effect, in the order of `keys`.
 
-            Currently, the procedure is to move the right stick around, release,
-              and press the West button (square on PS, X on MS). Future
-              implementations may support other sticks or specified buttons
-            """
+        Raises:
+          ValueError: If the effects, with those already pinned,
+            do not fit on the device at once.
+        """
+        keys = list(keys)
+        with self._lock:
+            needed = len(set(keys) | set(self._pinned))
+            if needed > self.capacity:
+                raise ValueError(
+                    f"{needed} effects must stay uploaded but the device "
+                    f"holds {self.capacity}"
+                )
+            ids = []
+            for key in keys:
+                ids.append(self._get(key))
+                self._pinned[key] = self._pinned.get(key, 0) + 1
+            return ids
 
-            while True:
-                self.calibrateStickDisplay()
-                stickPos = tuple(self.joystick.getAllAxes())
-                buttons = self.joystick.getAllButtons()
-                if buttons[3]:
-                    self.joystick.setOffset(stickPos)
-                    return
-                self.window.flip()
+    def unpin(self, keys):
+        """Release effects pinned by `pin`; they stay uploaded until
+        the pool needs room."""
+        with self._lock:
+            for key in keys:
+                count = self._pinned.get(key, 0) - 1
+                if count > 0:
+                    self._pinned[key] = count
+                else:
+                    self._pinned.pop(key, None)
 
+    def _get(self, key):
         try:
-            sMag = kwargs["sMag"]
-        except KeyError:
-            sMag = 0x0000
-        try:
-            wMag = kwargs["wMag"]
-        except KeyError:
-            wMag = 0x0F00
-        try:
-            step = kwargs["step"]
+            self._effects.move_to_end(key)
+            return self._effects[key]
         except KeyError:
-            step = 0x0400
+            pass
+        while len(self._effects) >= self.capacity:
+            old = next((k for k in self._effects if k not in self._pinned), None)
+            if old is None:
+                raise RuntimeError("Every uploaded effect is pinned")
+            self.device.erase_effect(self._effects.pop(old))
+        effect_id = self.device.upload_effect(rumbleEffect(*key))
+        self._effects[key] = effect_id
+        return effect_id
 
-        calibrateRumble(sMag, wMag)
-        calibrateStick()
+    def clear(self):
+        """Erase every effect in the pool from the device."""
+        with self._lock:
+            while self._effects:
+                _, effect_id = self._effects.popitem()
+                self.device.erase_effect(effect_id)
 
-    def checkHold(self):
-        while True:
-            if True not in self.joystick.getAllButtons():
-                break
-            self.window.flip()
+    def __contains__(self, key):
+        return key in self._effects
 
-    def on_run_end(self):
-        """Callback for end of a run loop. Replace with own method."""
-        pass
+    def __len__(self):
+        return len(self._effects)
 
-    def on_run_loop(self, frame):
-        """Callback at start of every run loop."""
-        pass
 
-    def run(self, n=1, func=None, funcargs=[], funckwargs={}):
-        """Run the provided function in a loop.
+class RumblePlayback:
+    """A rumble pattern queued on a `HapticSequencer`.
 
-        This method abstracts running `visual.window.flip` loops and
-            the experiment. T
-          drawing objects to the screen. Th provided function is run
-          on each loop and is provided the `window` object and the
-          frame number (starting from 0). These can be used to do
-          more fine-grained editing within the callback.
+    Attributes:
+      pattern (list): ``(onset, duration, magnitude)`` tuples,
+        sorted by onset.
+      start (float): Monotonic time the onsets are relative to.
+        Set when playback begins if it was not given.
+      log (list): ``(scheduled, written)`` monotonic times of each
+        pulse written to the device.
+      cancelled (bool): Whether `cancel` was called.
+      error (Exception): What stopped the pattern if writing to
+        the device failed, otherwise None.
+    """
 
-        The callback function should return a list of objects to
-          draw in the order they should be drawn.
+    error = None
 
-        Warning:
-          The callback function should not flip the window.
-            Doing so will introduce errors into your experiment timing.
+    def __init__(self, pattern, start=None):
+        # Magnitudes may mix ints and (strong, weak) pairs, which
+        #  cannot be compared, so only the onsets are
+        self.pattern = sorted(pattern, key=lambda pulse: pulse[0])
+        for onset, duration, magnitude in self.pattern:
+            if onset < 0 or duration <= 0:
+                raise ValueError(f"Invalid pulse {(onset, duration, magnitude)}")
+        self.start = start
+        self.log = []
+        self.cancelled = False
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
 
-        Keyword arguments:
-          n (int): The number of frames to run. On a monitor with a
-            60Hz refresh rate, each frame corresponds to roughly 17ms.
-            Defaults to 1.
-          func (function): A callback function to run on each loop
-            pass. The first argument to this callback will be the
-            the frame number. This function should return a list of
-            objects to draw.
-          funcargs (list): Positional arguments for func.
-          funckwargs (dictionary): Keyword arguments for func.
-        """
-        for frameN in range(n):
-            try:
-                self.on_run_loop(frameN)
-            except StopIteration:
-                self.checkHold()
-                break
-            try:
-                draw = func(frameN, *funcargs, **funckwargs)
-                for obj in draw:
-                    obj.draw()
-            except TypeError as e:
-                pass
-            except StopIteration:
-                break
-            self.window.flip()
-        self.on_run_end()
+    def cancel(self):
+        """Stop the pattern, or drop it if it has not started."""
+        self.cancelled = True
+        self._cancel.set()
 
-    def stickPos(self, start=-3, stop=-1, tolerance=0.1, scale=0.25):
-        """Provide the stick position, inverting y-axis if needed."""
-        pos = self.joystick.getAllAxes()[start:stop]
-        if self.invert_y_axis:
-            pos[1] *= -1
-        pos = [x * scale if abs(x) > tolerance else 0.0 for x in pos]
-        return tuple(pos)
+    def done(self):
+        """Whether the pattern has finished or been cancelled."""
+        return self._done.is_set()
 
+    def wait(self, timeout=None):
+        """Block until the pattern is done. Returns `done()`."""
+        return self._done.wait(timeout)
 
-class Trial:
-    def __init__(self, name, num, experiment):
-        self.name = name
-        self.number = num
-        self.experiment = experiment
-        self.data = {"trial_name": name, "trial_number": num, "data": {}}
+    def addDoneCallback(self, func):
+        """Call `func` from the sequencer's thread once the pattern
+        is done, or now if it already is."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(func)
+                return
+        func()
+
+    def __await__(self):
+        """Wait from a coroutine until the last pulse has ended.
+
+        Returns:
+          True if the pattern played to its end, False if it was
+          cancelled or failed.
+        """
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def finished():
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+        self.addDoneCallback(finished)
+        yield from done.__await__()
+        if self.cancelled or self.error is not None or self.start is None:
+            return False
+        end = self.start + max(
+            (onset + duration for onset, duration, _ in self.pattern), default=0
+        )
+        delay = end - time.monotonic()
+        if delay > 0:
+            yield from asyncio.sleep(delay).__await__()
+        return not self.cancelled
+
+    def keys(self):
+        """The ``(sMag, wMag, duration)`` effect of each pulse."""
+        keys = []
+        for onset, duration, magnitude in self.pattern:
+            try:
+                sMag, wMag = magnitude
+            except TypeError:
+                sMag, wMag = 0, magnitude
+            keys.append((sMag, wMag, round(duration * 1000)))
+        return keys
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func()
+
+
+class HapticSequencer:
+    """Play rumble patterns on a device from a timing thread.
+
+    A pattern is a list of ``(onset, duration, magnitude)`` tuples.
+    Onsets and durations are in seconds, onsets relative to the
+    pattern's start. A magnitude is either a weak motor magnitude
+    or a ``(strong, weak)`` pair.
+
+    Patterns are played one after another in the order they were
+    queued. Before a pattern starts its effects are uploaded and
+    pinned in the device's `EffectPool`, so each pulse is a single
+    ``EV_FF`` write and no effect is erased while the pattern plays.
+    A pattern that fails, say because the controller was unplugged,
+    records the error on its `RumblePlayback` and the sequencer
+    goes on to the next. Pulses are scheduled on the monotonic clock:
+    the thread sleeps until shortly before each onset and spins
+    for the rest, so timing does not depend on the frame loop.
+    """
+
+    def __init__(self, device, spin=0.002):
+        """Start the sequencer thread.
+
+        Arguments:
+          device (HapticDevice): The device to play patterns on.
+
+        Keyword arguments:
+          spin (float): Seconds before each onset to stop sleeping
+            and busy-wait instead, to absorb scheduler latency. The
+            wait yields the GIL on every check; 0 only sleeps.
+        """
+        self.device = device
+        self.spin = spin
+        self._queue = collections.deque()
+        self._current = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="HapticSequencer", daemon=True
+        )
+        self._thread.start()
+
+    def play(self, pattern, start=None):
+        """Queue a pattern.
+
+        Arguments:
+          pattern (list): ``(onset, duration, magnitude)`` tuples.
+
+        Keyword arguments:
+          start (float): Monotonic time to play the pattern at.
+            Defaults to as soon as the patterns before it finish.
+
+        Returns:
+          A `RumblePlayback` to follow or cancel the pattern.
+
+        Raises:
+          ValueError: If an onset is negative, a duration is not
+            positive, or the pattern has more distinct pulses than
+            the device can hold uploaded.
+          RuntimeError: If the sequencer is closed.
+        """
+        playback = RumblePlayback(pattern, start)
+        capacity = self.device.effects.capacity
+        if len(set(playback.keys())) > capacity:
+            raise ValueError(
+                f"Pattern has more distinct pulses than the device's {capacity} "
+                "effects"
+            )
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Sequencer is closed")
+            self._queue.append(playback)
+            self._cond.notify()
+        return playback
+
+    def cancel(self):
+        """Cancel the playing pattern and everything queued."""
+        with self._cond:
+            pending = list(self._queue)
+            if self._current is not None:
+                pending.append(self._current)
+        for playback in pending:
+            playback.cancel()
+
+    def close(self):
+        """Cancel all patterns and stop the thread."""
+        self.cancel()
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                self._current = playback = self._queue.popleft()
+            try:
+                if not playback.cancelled:
+                    self._play(playback)
+            except Exception as e:
+                playback.error = e
+            finally:
+                with self._cond:
+                    self._current = None
+                playback._finish()
+
+    def _play(self, playback):
+        effects = self.device.effects
+        keys = playback.keys()
+        ids = effects.pin(keys)
+        try:
+            if playback.start is None:
+                playback.start = time.monotonic()
+            playing = None
+            for (onset, _, _), effect_id in zip(playback.pattern, ids):
+                target = playback.start + onset
+                if not self._sleepUntil(target, playback._cancel):
+                    break
+                self.device.write(ecodes.EV_FF, effect_id, 1)
+                playback.log.append((target, time.monotonic()))
+                playing = effect_id
+            if playback.cancelled and playing is not None:
+                self.device.write(ecodes.EV_FF, playing, 0)
+        finally:
+            effects.unpin(keys)
+
+    def _sleepUntil(self, target, cancel):
+        """Wait for `target`; returns False if cancelled first."""
+        remaining = target - time.monotonic() - self.spin
+        if remaining > 0 and cancel.wait(remaining):
+            return False
+        while time.monotonic() < target:
+            if cancel.is_set():
+                return False
+            # Let the frame loop run while spinning
+            time.sleep(0)
+        return not cancel.is_set()
+
+
+DeviceInfo = collections.namedtuple("DeviceInfo", "path name phys uniq")
+
+
+class DeviceRegistry:
+    """Index of the system's evdev input devices.
+
+    The devices in ``/dev/input`` are enumerated once and indexed by
+    path, name, phys and uniq, so looking one up does not open every
+    device. `refresh` only rescans when the directory has changed,
+    which it does whenever a device is plugged in or removed, and
+    `watch` does so on a background thread so a dropped controller
+    is noticed during a session. Device details are read from sysfs
+    rather than by opening each device.
+
+    Attributes:
+      root (string): Directory holding the event devices.
+      onAdd (list): Callables passed the `DeviceInfo` of each device
+        that appears.
+      onRemove (list): Callables passed the `DeviceInfo` of each
+        device that disappears.
+    """
+
+    _default = None
+
+    def __init__(self, root="/dev/input", sysfs="/sys/class/input"):
+        """Enumerate the devices.
+
+        Keyword arguments:
+          root (string): Directory holding the event devices.
+          sysfs (string): sysfs directory describing them.
+        """
+        self.root = root
+        self.sysfs = sysfs
+        self.onAdd = []
+        self.onRemove = []
+        self._devices = {}
+        self._index = {"name": {}, "phys": {}, "uniq": {}}
+        self._mtime = None
+        self._pyglet = None
+        self._lock = threading.RLock()
+        self._watcher = None
+        self._stopWatching = threading.Event()
+        self.refresh()
+
+    @classmethod
+    def default(cls):
+        """Get the registry shared by every HapticDevice."""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def refresh(self):
+        """Update the index if devices were added or removed.
+
+        Returns:
+          A tuple of the added and the removed `DeviceInfo` lists.
+        """
+        with self._lock:
+            try:
+                mtime = os.stat(self.root).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and mtime == self._mtime:
+                return [], []
+            self._mtime = mtime
+            try:
+                paths = {
+                    os.path.join(self.root, entry)
+                    for entry in os.listdir(self.root)
+                    if entry.startswith("event")
+                }
+            except FileNotFoundError:
+                paths = set()
+            removed = [self._remove(path) for path in set(self._devices) - paths]
+            added = [self._add(path) for path in sorted(paths - set(self._devices))]
+            if added or removed:
+                self._pyglet = None
+        for info in removed:
+            for callback in self.onRemove:
+                callback(info)
+        for info in added:
+            for callback in self.onAdd:
+                callback(info)
+        return added, removed
+
+    def _add(self, path):
+        info = DeviceInfo(path, *self._describe(path))
+        self._devices[path] = info
+        for key in self._index:
+            value = getattr(info, key)
+            if value:
+                self._index[key].setdefault(value, []).append(info)
+        return info
+
+    def _remove(self, path):
+        info = self._devices.pop(path)
+        for key in self._index:
+            value = getattr(info, key)
+            if value:
+                matches = self._index[key][value]
+                matches.remove(info)
+                if not matches:
+                    del self._index[key][value]
+        return info
+
+    def _describe(self, path):
+        """Read a device's name, phys and uniq from sysfs."""
+        base = os.path.join(self.sysfs, os.path.basename(path), "device")
+        values = []
+        for field in ("name", "phys", "uniq"):
+            try:
+                with open(os.path.join(base, field)) as f:
+                    values.append(f.read().strip())
+            except OSError:
+                values.append("")
+        return values
+
+    def get(self, path):
+        """Get a device's `DeviceInfo` by path, or None."""
+        return self._devices.get(path)
+
+    def find(self, name=None, phys=None, uniq=None):
+        """Get the devices matching every given field.
+
+        Returns:
+          A list of `DeviceInfo`, in path order.
+        """
+        query = {"name": name, "phys": phys, "uniq": uniq}
+        with self._lock:
+            matches = None
+            for key, value in query.items():
+                if value is None:
+                    continue
+                found = self._index[key].get(value, [])
+                if matches is None:
+                    matches = found
+                else:
+                    matches = [info for info in matches if info in found]
+            if matches is None:
+                matches = self._devices.values()
+            return sorted(matches)
+
+    def pygletInput(self, path):
+        """Get pyglet's index and input device for an evdev path.
+
+        pyglet's inputs are enumerated once and cached until a device
+        is added or removed.
+
+        Raises:
+          ValueError: If pyglet has no device at `path`.
+        """
+        with self._lock:
+            if self._pyglet is None:
+                # Assumes we're using pyglet
+                inputs = joystick.pyglet_input.get_inputs()
+                self._pyglet = {
+                    d.device._filename: (i, d) for i, d in enumerate(inputs)
+                }
+            try:
+                return self._pyglet[path]
+            except KeyError:
+                raise ValueError(f"No device found at {path}") from None
+
+    def watch(self, interval=0.5):
+        """Refresh on a background thread every `interval` seconds."""
+        if self._watcher is not None:
+            return
+        self._stopWatching.clear()
+        self._watcher = threading.Thread(
+            target=self._watch, args=(interval,), name="DeviceRegistry", daemon=True
+        )
+        self._watcher.start()
+
+    def stopWatching(self):
+        """Stop the background refresh."""
+        if self._watcher is None:
+            return
+        self._stopWatching.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def _watch(self, interval):
+        while not self._stopWatching.wait(interval):
+            self.refresh()
+
+    def __contains__(self, path):
+        return path in self._devices
+
+    def __iter__(self):
+        return iter(sorted(self._devices.values()))
+
+    def __len__(self):
+        return len(self._devices)
+
+
+class DeviceGroup:
+    """Read several haptic devices from one event loop.
+
+    Every member's evdev file descriptor is registered with a single
+    selector (epoll on Linux), so any number of controllers are read
+    by one thread, or by the experiment's own loop through `poll`,
+    instead of a reader thread each. While a device is in a group its
+    `getAllButtons`, `getAllAxes` and `getButtonTimes` return the
+    state built from its event stream, as with
+    `HapticDevice.startReader`.
+
+    Arguments:
+      devices (iterable): HapticDevices to read.
+
+    Keyword arguments:
+      bufferSize (int): Number of recent events kept in each device's
+        `events`.
+
+    Attributes:
+      devices (list): The member devices, in the order they were added.
+      onDisconnect (list): Callables passed each device found to be
+        unplugged. The device keeps its place in `devices` and is
+        read again after `HapticDevice.reattach`.
+      onEvents (list): Callables passed each device after its new
+        events have been processed, on the thread reading them.
+    """
+
+    def __init__(self, devices=(), bufferSize=4096):
+        self.devices = []
+        self.onDisconnect = []
+        self.onEvents = []
+        self.bufferSize = bufferSize
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._loop = None
+        self._thread = None
+        self._stop = threading.Event()
+        for device in devices:
+            self.add(device)
+
+    @classmethod
+    def open(cls, paths, **kwargs):
+        """Open a HapticDevice for each evdev path and group them."""
+        HapticDevice = _lazyClass("HapticDevice")
+        return cls([HapticDevice(dev=path) for path in paths], **kwargs)
+
+    def add(self, device):
+        """Start reading a device's events in this group."""
+        if device.group is not None:
+            raise ValueError(f"{device.path} is already in a device group")
+        device._initState(self.bufferSize)
+        with self._lock:
+            self._register(device)
+            self.devices.append(device)
+        device.group = self
+
+    def remove(self, device):
+        """Stop reading a device; it returns to pyglet's state."""
+        with self._lock:
+            self._drop(device)
+            self.devices.remove(device)
+        device.group = None
+
+    def _register(self, device):
+        self._selector.register(device.fd, selectors.EVENT_READ, device)
+        if self._loop is not None:
+            self._loop.add_reader(device.fd, self._service, [device])
+
+    def _drop(self, device):
+        """Stop selecting a device's descriptor, keeping its place."""
+        with self._lock:
+            try:
+                self._selector.unregister(device.fd)
+            except KeyError:
+                return
+            if self._loop is not None:
+                self._loop.remove_reader(device.fd)
+
+    def _rejoin(self, device):
+        """Select a reattached device's new descriptor."""
+        device._initState(self.bufferSize)
+        with self._lock:
+            self._register(device)
+
+    def poll(self, timeout=0):
+        """Process the events waiting on any member device.
+
+        Keyword arguments:
+          timeout (float): Seconds to wait for an event; None waits
+            indefinitely and 0 returns immediately.
+
+        Returns:
+          A list of the devices that had events.
+        """
+        # Select without the lock, so waiters and add or remove are
+        # not held up for the whole timeout
+        ready = self._selector.select(timeout)
+        return self._service([key.data for key, _ in ready])
+
+    def _service(self, ready):
+        """Drain the devices with events waiting and notify listeners."""
+        lost = []
+        with self._lock:
+            # A device may have been removed since it was selected
+            registered = self._selector.get_map()
+            ready = [
+                device
+                for device in ready
+                if device.fd in registered and registered[device.fd].data is device
+            ]
+            for device in ready:
+                try:
+                    device._drainEvents()
+                except OSError:
+                    # ENODEV: the controller was unplugged
+                    lost.append(device)
+            for device in lost:
+                self._drop(device)
+                device.connected = False
+            self._changed.notify_all()
+        ready = [device for device in ready if device not in lost]
+        for device in lost:
+            for callback in self.onDisconnect:
+                callback(device)
+        for device in ready:
+            for callback in self.onEvents:
+                callback(device)
+        return ready
+
+    def _waitFor(self, check, timeout=None):
+        """Block until `check()` returns anything but None.
+
+        While the group's thread runs this sleeps until the thread
+        has processed new events; otherwise it polls the group on
+        the calling thread.
+
+        Raises:
+          ConnectionError: Every device in the group is unplugged,
+            so `check` can no longer change.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        remaining = timeout
+        while True:
+            with self._changed:
+                result = check()
+                if result is not None:
+                    return result
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                if not self._selector.get_map():
+                    raise ConnectionError("Every device in the group is unplugged")
+                if self._thread is not None:
+                    self._changed.wait(remaining)
+                    continue
+            self.poll(remaining)
+
+    def attach(self, loop):
+        """Read the group from an asyncio event loop's selector.
+
+        Each device's events are processed as soon as the loop
+        sees them, between the loop's other callbacks, instead of
+        on a background thread.
+
+        Arguments:
+          loop (asyncio.AbstractEventLoop): A selector-based loop,
+            such as the default loop on Linux.
+        """
+        self.stop()
+        with self._lock:
+            self.detach()
+            self._loop = loop
+            for device in self.devices:
+                if device.connected:
+                    loop.add_reader(device.fd, self._service, [device])
+
+    def detach(self):
+        """Stop reading the group from its event loop."""
+        with self._lock:
+            if self._loop is None:
+                return
+            for key in self._selector.get_map().values():
+                self._loop.remove_reader(key.fd)
+            self._loop = None
+
+    def start(self):
+        """Poll the group on one background thread."""
+        if self._thread is not None:
+            return
+        self.detach()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="DeviceGroup", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread; the group can still be polled."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        """Stop reading and release every member device."""
+        self.stop()
+        self.detach()
+        for device in list(self.devices):
+            self.remove(device)
+        self._selector.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll(0.1)
+
+    def snapshot(self, i):
+        """Get a device's (buttons, axes, buttonTimes) as one tuple.
+
+        The snapshot is the state as of the device's last complete
+        report; its axes are raw, without the device's offset.
+        """
+        return self.devices[i]._snapshot
+
+    def snapshots(self):
+        """Get the snapshot of every member device."""
+        return [device._snapshot for device in self.devices]
+
+    def rumble(self, i, *args, **kwargs):
+        """Rumble one device; arguments are as for `HapticDevice.rumble`."""
+        self.devices[i].rumble(*args, **kwargs)
+
+    def rumbleAll(self, *args, **kwargs):
+        """Rumble every device with the same arguments."""
+        for device in self.devices:
+            device.rumble(*args, **kwargs)
+
+    def __getitem__(self, i):
+        return self.devices[i]
+
+    def __iter__(self):
+        return iter(self.devices)
+
+    def __len__(self):
+        return len(self.devices)
+
+
+class ReplayDevice:
+    """Stand-in for `HapticDevice` driven by scripted input.
+
+    The device plays back a sequence of frames, each a pair of
+    ``(buttons, axes)`` as `HapticDevice.getAllButtons` and
+    `HapticDevice.getAllAxes` would return them before the offset
+    is applied. It moves to the next frame every time the window
+    it is attached to flips and holds the last frame once the
+    script runs out. Rumble requests are recorded in `rumbles`
+    instead of being sent anywhere.
+
+    Together with `NullWindow` this lets an `Experiment` run
+    without a controller or a display::
+
+        win = NullWindow()
+        device = ReplayDevice(frames, win)
+        MyExperiment(win, joystick=device)
+
+    Attributes:
+      frames (list): The scripted ``(buttons, axes)`` frames.
+      frameN (int): Index of the current frame.
+      rumbles (list): ``(frame, sMag, wMag, duration, repeat)`` for
+        every rumble requested.
+      offset (numpy.ndarray): Subtracted from all axes, if set.
+    """
+
+    strongMagnitude = _HapticDevice.strongMagnitude
+    weakMagnitude = _HapticDevice.weakMagnitude
+    offset = None
+
+    def __init__(self, frames, window=None):
+        """Create a replay device.
+
+        Arguments:
+          frames (iterable): ``(buttons, axes)`` pairs, one per frame.
+
+        Keyword arguments:
+          window (NullWindow): Window whose flips advance the script.
+            Without one, call `step` to advance.
+
+        Raises:
+          ValueError: If there are no frames.
+        """
+        self.frames = [(list(b), list(a)) for b, a in frames]
+        if not self.frames:
+            raise ValueError("A replay needs at least one frame")
+        self.frameN = 0
+        self.rumbles = []
+        if window is not None:
+            window.onFlip.append(self.step)
+
+    @classmethod
+    def fromArrays(cls, buttons, axes, nButtons=16, window=None):
+        """Create a replay from recorded arrays.
+
+        Arguments:
+          buttons (numpy.ndarray): Per-frame button state, either
+            as bitmasks (see `buttonMask`) or as rows of booleans.
+          axes (numpy.ndarray): Per-frame raw axes, one row a frame.
+
+        Keyword arguments:
+          nButtons (int): Number of buttons to unpack from bitmasks.
+          window (NullWindow): See `__init__`.
+        """
+        buttons = np.asarray(buttons)
+        if buttons.ndim == 1:
+            bits = np.arange(nButtons, dtype=np.uint64)
+            buttons = (buttons.astype(np.uint64)[:, None] >> bits) & 1
+        return cls(
+            zip(buttons.astype(bool).tolist(), np.asarray(axes).tolist()), window
+        )
+
+    def step(self):
+        """Move to the next scripted frame."""
+        if self.frameN < len(self.frames) - 1:
+            self.frameN += 1
+
+    def finished(self):
+        """Whether the script is on its last frame."""
+        return self.frameN == len(self.frames) - 1
+
+    def getAllButtons(self):
+        return list(self.frames[self.frameN][0])
+
+    def getButtonTimes(self):
+        return (None,) * len(self.frames[self.frameN][0])
+
+    def getAllAxes(self):
+        axes = list(self.frames[self.frameN][1])
+        if self.offset is None:
+            return axes
+        return np.subtract(axes, self.offset)
+
+    def getHat(self, n):
+        return (0, 0)
+
+    def calibrateRumble(self, sMag, wMag):
+        """Record a calibration rumble. See `HapticDevice.calibrateRumble`."""
+        if sMag <= 0 and wMag <= 0:
+            raise ValueError("Rumble cannot be zero")
+        self.rumble(sMag=sMag, wMag=wMag)
+
+    def calibrateStick(self, win, display=None, displayArgs=[], frames=60):
+        """See `HapticDevice.calibrateStick`; the scripted axes are
+        sampled for `frames` flips after the west button."""
+
+        def show():
+            try:
+                display(*displayArgs)
+            except TypeError:
+                pass
+
+        show()
+        while not self.getAllButtons()[3]:
+            win.flip()
+            show()
+        win.flip()
+        stats = RunningStats(len(self.frames[self.frameN][1]))
+        stats.add(self.frames[self.frameN][1])
+        for _ in range(frames):
+            win.flip()
+            show()
+            stats.add(self.frames[self.frameN][1])
+        self.setOffset(stats.mean)
+        return stats
+
+    def rumble(self, repeat=1, sMag=None, wMag=None, duration=100):
+        if sMag is None:
+            sMag = self.strongMagnitude
+        if wMag is None:
+            wMag = self.weakMagnitude
+        self.rumbles.append((self.frameN, sMag, wMag, duration, repeat))
+
+    def setMagnitudes(self, sMag, wMag):
+        self.strongMagnitude = sMag
+        self.weakMagnitude = wMag
+
+    setOffset = _HapticDevice.setOffset
+
+
+class NullWindow:
+    """Window stand-in that draws nothing.
+
+    Flips return immediately, or are paced to the frame rate when
+    `realtime` is set, so an experiment can run headless either to
+    check its logic at simulated speed or to measure the
+    framework's own overhead as fast as possible.
+
+    Attributes:
+      frameN (int): Number of flips so far.
+      monitorFramePeriod (float): Simulated seconds per frame.
+      realtime (bool): Whether flips wait for the next frame.
+      onFlip (list): Functions called, without arguments, on
+        every flip.
+    """
+
+    def __init__(self, fps=60.0, realtime=False):
+        """Create a window.
+
+        Keyword arguments:
+          fps (float): Simulated refresh rate.
+          realtime (bool): Pace flips to `fps`.
+        """
+        self.frameN = 0
+        self.monitorFramePeriod = 1.0 / fps
+        self.realtime = realtime
+        self.onFlip = []
+        self._callOnFlip = []
+        self._nextFlip = None
+
+    def flip(self, clearBuffer=True):
+        """Finish a frame, returning the flip time."""
+        if self.realtime:
+            now = time.monotonic()
+            if self._nextFlip is None or self._nextFlip < now:
+                self._nextFlip = now
+            else:
+                time.sleep(self._nextFlip - now)
+            self._nextFlip += self.monitorFramePeriod
+        for func in self.onFlip:
+            func()
+        for func, args, kwargs in self._callOnFlip:
+            func(*args, **kwargs)
+        self._callOnFlip.clear()
+        self.frameN += 1
+        return time.monotonic()
+
+    def callOnFlip(self, function, *args, **kwargs):
+        """Call `function` once, at the next flip."""
+        self._callOnFlip.append((function, args, kwargs))
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return 1.0 / self.monitorFramePeriod
+
+    def close(self):
+        pass
+
+
+Asset = collections.namedtuple("Asset", "kind data sampleRate nbytes digest")
+Asset.__doc__ = """A decoded stimulus file held by an `AssetCache`.
+
+``kind`` is ``"image"`` or ``"sound"``. Images are RGBA ``uint8``
+arrays; sounds are ``float32`` arrays of samples with their
+``sampleRate``.
+"""
+
+
+class AssetCache:
+    """Decode stimulus files on a thread pool and keep them in memory.
+
+    Files are read and decoded on worker threads, so a whole
+    stimulus set can be loaded in parallel with `prefetch` while
+    the main thread does other work, or loaded on first use with
+    `get`. Files are identified by their real path and by a hash
+    of their contents, so the same file under several names, or
+    several identical files, are decoded and stored once.
+
+    Decoded assets are kept up to `maxBytes`; past that, the least
+    recently used are dropped and decoded again if needed. With a
+    `cacheDir`, decoded assets are also saved as ``.npz`` files
+    named by content hash, and later sessions load those instead
+    of decoding again.
+
+    Decoding only touches NumPy arrays; psychopy stims, which need
+    the window's GL context, are built on the calling thread by
+    `image` and `sound`.
+
+    Attributes:
+      window (psychopy.visual.Window): Window images are built for.
+      maxBytes (int): Memory cap for decoded assets.
+      cacheDir (string): On-disk cache directory, or None.
+      nbytes (int): Bytes of decoded assets currently held.
+    """
+
+    IMAGE_TYPES = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff")
+
+    def __init__(self, window, maxBytes=512 * 2 ** 20, workers=4, cacheDir=None):
+        """Create an empty cache.
+
+        Arguments:
+          window (psychopy.visual.Window): Window to build images for.
+
+        Keyword arguments:
+          maxBytes (int): Memory cap for decoded assets.
+          workers (int): Number of decoding threads.
+          cacheDir (string): Directory for the on-disk cache. It is
+            created if missing.
+        """
+        self.window = window
+        self.maxBytes = maxBytes
+        self.cacheDir = cacheDir
+        if cacheDir is not None:
+            os.makedirs(cacheDir, exist_ok=True)
+        self.nbytes = 0
+        self._assets = collections.OrderedDict()  # digest -> Asset
+        self._digests = {}  # real path -> digest
+        self._pending = {}  # real path -> Future
+        self._lock = threading.Lock()
+        self._workers = workers
+        self._pool = None
+
+    def prefetch(self, paths):
+        """Start decoding `paths` in the background."""
+        for path in paths:
+            self._request(path)
+
+    def get(self, path):
+        """Get the decoded `Asset` for `path`, decoding it if needed.
+
+        Raises:
+          ValueError: If the file type is not supported.
+        """
+        return self._request(path).result()
+
+    def image(self, path, **kwargs):
+        """Build a ``visual.ImageStim`` from a cached image.
+
+        Keyword arguments are passed to ``visual.ImageStim``.
+        """
+        from PIL import Image
+
+        asset = self.get(path)
+        return visual.ImageStim(
+            self.window, image=Image.fromarray(asset.data), **kwargs
+        )
+
+    def sound(self, path, **kwargs):
+        """Build a ``Sound`` from a cached sound file.
+
+        Keyword arguments are passed to ``Sound``.
+        """
+        asset = self.get(path)
+        return sound.Sound(asset.data, sampleRate=asset.sampleRate, **kwargs)
+
+    def close(self):
+        """Stop the decoding threads."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __contains__(self, path):
+        with self._lock:
+            return self._digests.get(os.path.realpath(path)) in self._assets
+
+    def __len__(self):
+        return len(self._assets)
+
+    def _request(self, path):
+        key = os.path.realpath(path)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest in self._assets:
+                self._assets.move_to_end(digest)
+                done = futures.Future()
+                done.set_result(self._assets[digest])
+                return done
+            try:
+                return self._pending[key]
+            except KeyError:
+                pass
+            if self._pool is None:
+                self._pool = futures.ThreadPoolExecutor(
+                    self._workers, thread_name_prefix="AssetCache"
+                )
+            future = self._pool.submit(self._load, key)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._pending.pop(key, None))
+        return future
+
+    def _load(self, path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+        with self._lock:
+            self._digests[path] = digest
+            if digest in self._assets:
+                self._assets.move_to_end(digest)
+                return self._assets[digest]
+
+        asset = self._loadCached(digest)
+        if asset is None:
+            asset = self._decode(path, raw, digest)
+            self._saveCached(asset)
+
+        with self._lock:
+            if digest in self._assets:
+                return self._assets[digest]
+            self._assets[digest] = asset
+            self.nbytes += asset.nbytes
+            while self.nbytes > self.maxBytes and len(self._assets) > 1:
+                _, old = self._assets.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return asset
+
+    def _decode(self, path, raw, digest):
+        if path.lower().endswith(self.IMAGE_TYPES):
+            from PIL import Image
+
+            with Image.open(io.BytesIO(raw)) as im:
+                data = np.asarray(im.convert("RGBA"))
+            return Asset("image", data, None, data.nbytes, digest)
+        try:
+            import soundfile
+        except ImportError:
+            raise ValueError(f"Cannot decode {path}: soundfile is not installed")
+        try:
+            data, rate = soundfile.read(io.BytesIO(raw), dtype="float32")
+        except RuntimeError as e:
+            raise ValueError(f"Cannot decode {path}: {e}")
+        return Asset("sound", data, rate, data.nbytes, digest)
+
+    def _cachePath(self, digest):
+        return os.path.join(self.cacheDir, digest + ".npz")
+
+    def _loadCached(self, digest):
+        if self.cacheDir is None:
+            return None
+        try:
+            with np.load(self._cachePath(digest)) as cached:
+                kind = str(cached["kind"])
+                data = cached["data"]
+                rate = int(cached["sampleRate"]) if kind == "sound" else None
+        except (OSError, KeyError, ValueError):
+            return None
+        return Asset(kind, data, rate, data.nbytes, digest)
+
+    def _saveCached(self, asset):
+        if self.cacheDir is None:
+            return
+        path = self._cachePath(asset.digest)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                kind=asset.kind,
+                data=asset.data,
+                sampleRate=asset.sampleRate or 0,
+            )
+        os.replace(tmp, path)
+
+
+class Layer:
+    """Static stims drawn as one pre-rendered image.
+
+    The first draw renders the member stims into the back buffer and
+    captures them as a `visual.BufferImageStim`; later draws blit
+    that image instead of drawing each member. Before every draw the
+    members' position, size, orientation, opacity and text are
+    compared with those at capture, and the image is captured again
+    if any of them changed, so members can be moved between uses.
+
+    Capturing clears the back buffer and the image covers the whole
+    window, so draw a layer before anything else in a frame.
+    Capturing also reads the frame back from the GPU, which makes
+    that frame slow, so call `refresh` after setting a layer's stims
+    up, before any timed frame. `Experiment.runTimeline` refreshes
+    the layers it draws before its first frame. Changes the
+    comparison does not see, such as a new ``image`` on an
+    `ImageStim`, need a call to `invalidate`.
+
+    A layer can be drawn anywhere a stim can: returned from a `run`
+    callback, in a `Phase`'s draw list or in a calibration display.
+
+    Attributes:
+      window (psychopy.visual.Window): The window drawn to.
+      stims (list): The member stims, in drawing order.
+      builds (int): Number of times the image has been captured.
+    """
+
+    ATTRIBUTES = ("pos", "size", "ori", "opacity", "text")
+
+    def __init__(self, win, stims):
+        """Create a layer.
+
+        Arguments:
+          win (psychopy.visual.Window): The window to draw to.
+          stims (list): The stims to draw, in order.
+        """
+        self.window = win
+        self.stims = list(stims)
+        self.builds = 0
+        self._buffer = None
+        self._signature = None
+
+    def signature(self):
+        """The attributes that invalidate the image when changed."""
+        signature = [_snapshot(getattr(self.window, "size", None))]
+        for stim in self.stims:
+            for attr in self.ATTRIBUTES:
+                signature.append(_snapshot(getattr(stim, attr, None)))
+        return signature
+
+    def build(self):
+        """Capture the members now, rather than on the next draw."""
+        self._buffer = visual.BufferImageStim(self.window, stim=self.stims)
+        self._signature = self.signature()
+        self.builds += 1
+        return self._buffer
+
+    def refresh(self):
+        """Capture the members now if they changed since the last
+        capture. Returns whether they were captured."""
+        if self._signature is not None and self.signature() == self._signature:
+            return False
+        self.build()
+        return True
+
+    def invalidate(self):
+        """Capture the members again on the next draw."""
+        self._signature = None
+
+    def draw(self, win=None):
+        """Draw the image, capturing it first if it is stale."""
+        self.refresh()
+        self._buffer.draw()
+
+
+def _snapshot(value):
+    """Copy a stim attribute, so changes made in place are seen."""
+    tolist = getattr(value, "tolist", None)
+    return value if tolist is None else tolist()
+
+
+class Experiment:
+    """Experiment objects control the flow of an experiment and
+    serve as an abstraction layer above the hardware and
+    graphics managment layers. It is set up to primarily use
+    callback methods allowing external definition of processes
+    without requiring (but still allowing) management of the
+    execution chain.
+
+    The best way to use this is by extending the class, creating
+    a child experiment and overwriting methods where needed.
+
+    Attributes:
+      window (psychopy.visual.window): The psychopy window in
+        use for this experiment.
+      joystick (HapticDevice): The joystick in use. If it is
+        unplugged, waits raise `ConnectionError` and it is not
+        reattached automatically; see `HapticDevice.reattach`.
+      devices (DeviceGroup): All controllers in use, when set with
+        `setJoysticks`.
+      stims: Will be set to the output of the `makeStims`
+        callback. See `makeStims`.
+      invert_y_axis (bool): Whether the stick position's y-axis
+        should be inverted by default.
+      writer (DataWriter): Streams logged data to disk, or None
+        if no `datafile` was given.
+      eventLog (EventLog): Logs the joystick's raw events, or None
+        if no `eventlog` was given.
+      assets (AssetCache): Loads image and sound files for
+        `makeStims`.
+      frameRate (float): Refresh rate of the window in Hz.
+      flipTime (float): When the last flip returned, in seconds on
+        the monotonic clock (``time.monotonic()``).
+      frameTimer (FrameTimer): Records per-frame stage timings in
+        `run`, or None when instrumentation is off. See `instrument`.
+      runTiming (dictionary): `FrameTimer.summary` of the last
+        instrumented `run`.
+      stickDeadzone (tuple): Dead zone of each axis measured by
+        `calibrate`, used by `stickPos` in place of its tolerance,
+        or None before calibration.
+      drift (RunningStats): Exponentially weighted statistics of
+        the raw axes while the controller is at rest, sampled on
+        every flip after `calibrate`. See `recalibrateStick`.
+    """
+
+    _stickKey = None
+    stickDeadzone = None
+    drift = None
+    _inputLoop = None
+    _inputReader = False
+    devices = None
+    frameTimer = None
+    runTiming = None
+
+    def __init__(self, w, **kwargs):
+        """Create an Experiment object
+
+        Arguments:
+          w (psychopy.visual.Window): the psychopy window to use
+            for this experiment
+
+        Keyword arguments:
+          joystick (HapticDevice, optional): The joystick to
+            send haptic events to. If not given, `setJoystick`
+            is called to create one.
+          stims (function): A callback function used to make the
+            stimuli on initialization. The function will be passed
+            the `window` attribute as the first argument and then
+            the arguments in `stimargs` and `stimkwargs`.
+          stimargs (list): Arguments to pass to the `stims` callback.
+          stimkwargs (dictionary): Keyword arguments to pass to the
+            `stims` callback.
+          datafile (string): Path of a file that every record passed
+            to `log_data` is appended to as it is logged. Files
+            ending in ``.csv`` are written as CSV, anything else
+            as JSON lines.
+          fps (float): Refresh rate of the window. Defaults to the
+            rate psychopy measured for the window.
+          instrument (bool): Record frame timings in `run`. See
+            `instrument`.
+          assetMemory (int): Bytes of decoded stimuli `assets` may
+            keep in memory.
+          assetCache (string): Directory `assets` keeps decoded
+            stimuli in between sessions.
+          eventlog (string): Path of an `EventLog` that every raw
+            event of the joystick is logged to for the session.
+        """
+        self.data = Data()
+        self.window = w
+        self.flipTime = None
+        self._flipStamps = []
+        self._waiters = []
+        try:
+            assetMemory = kwargs["assetMemory"]
+        except KeyError:
+            assetMemory = 512 * 2 ** 20
+        try:
+            assetCache = kwargs["assetCache"]
+        except KeyError:
+            assetCache = None
+        self.assets = AssetCache(w, assetMemory, cacheDir=assetCache)
+        try:
+            self.frameRate = kwargs["fps"]
+        except KeyError:
+            self.frameRate = 1.0 / w.monitorFramePeriod
+        try:
+            self.writer = DataWriter(kwargs["datafile"])
+        except KeyError:
+            self.writer = None
+        self.makeStims()
+        try:
+            self.joystick = kwargs["joystick"]
+        except KeyError:
+            self.setJoystick()
+        try:
+            self.eventLog = EventLog(kwargs["eventlog"])
+        except KeyError:
+            self.eventLog = None
+        else:
+            self.joystick.logEvents(self.eventLog)
+        try:
+            self.invert_y_axis = kwargs["invertaxis"]
+        except KeyError:
+            self.invert_y_axis = False
+        try:
+            self.instrument(kwargs["instrument"])
+        except KeyError:
+            pass
+
+    def log_data(self, data):
+        """Add a record, such as a finished `Trial.data`, to the
+        experiment's data and queue it for writing to `datafile`.
+
+        The record is serialized later on the writer's thread,
+        so it must not be modified after it is logged.
+        """
+        self.data.append(data)
+        if self.writer is not None:
+            self.writer.write(data)
+
+    def runTrials(self, trials, depth=1):
+        """Run trials back to back, preparing the next ones while
+        each runs.
+
+        Each trial is fired, its data logged with `log_data`, and
+        the stick recalibrated with `recalibrateStick` before the
+        next trial starts. See `TrialPrefetcher`.
+
+        Arguments:
+          trials (iterable): `Trial` objects, in running order.
+
+        Keyword arguments:
+          depth (int): How many trials to prepare ahead.
+
+        Returns:
+          The `TrialPrefetcher`, whose `waited` is the time spent
+          waiting for trials to be prepared.
+        """
+        prefetcher = TrialPrefetcher(trials, depth)
+        for trial in prefetcher:
+            trial.fire()
+            self.log_data(trial.data)
+            self.recalibrateStick()
+        return prefetcher
+
+    def flip(self):
+        """Flip the window and record when the flip returned.
+
+        Returns:
+          The flip time in seconds on the monotonic clock, the
+          clock `HapticDevice` event timestamps are on.
+        """
+        self.window.flip()
+        self.flipTime = t = time.monotonic()
+        for timing, key in self._flipStamps:
+            timing[key] = t
+        self._flipStamps.clear()
+        if self.drift is not None:
+            self._sampleRest()
+        return t
+
+    def stampNextFlip(self, timing, key):
+        """Set ``timing[key]`` to the time of the next flip.
+
+        Use this for onsets of stimuli drawn on the current frame,
+        which only appear once the window has been flipped.
+        """
+        self._flipStamps.append((timing, key))
+
+    def responseTime(self, button):
+        """When `button` last changed state, on the monotonic clock.
+
+        This is the kernel timestamp of the evdev event if the
+        joystick's background reader is running, otherwise the
+        current time, which is only as precise as the frame rate.
+        """
+        t = self.joystick.getButtonTimes()[button]
+        if t is None:
+            return time.monotonic()
+        return t
+
+    def makeStims(self):
+        """Overwrite with own function."""
+        pass
+
+    def layer(self, stims):
+        """Group static stims into a `Layer` on this window.
+
+        Arguments:
+          stims (list): Stims that do not change while shown.
+
+        Returns:
+          A `Layer` to draw in place of the stims.
+        """
+        return Layer(self.window, stims)
+
+    def setJoystick(self):
+        """Creates default joystick, can overwrite with own function."""
+        self.joystick = _lazyClass("HapticDevice")()
+
+    def setJoysticks(self, paths):
+        """Read several controllers from one background thread.
+
+        The devices are kept in `devices`, a `DeviceGroup`, and the
+        first of them becomes `joystick`.
+
+        Arguments:
+          paths (iterable): evdev paths of the controllers.
+        """
+        self.devices = DeviceGroup.open(paths)
+        self.devices.start()
+        self.joystick = self.devices[0]
+
+    def calibrate(self, *args, **kwargs):
+        """Runs the joystick calibration methods.
+
+        The weak motor's magnitude is calibrated with a `Staircase`:
+        each presentation rumbles once, the participant presses the
+        south button if they felt it and the east button if not,
+        and the magnitude steps down or up, in steps halved at every
+        reversal down to `precision`, until it has reversed
+        `reversals` times at that step. The mean of those reversals
+        becomes the joystick's magnitude. Each presentation
+        and the result are logged as records with a ``calibration``
+        key (see `log_data`).
+
+        Warning:
+          This should be considered highly unstable.
+            Its operation will be changed to accomodate changes in
+            the `haptic.HapticDevice` calibration scheme providing
+            a relatively seamless integration of calibration
+            into main experiment files.
+
+        Keyword arguments:
+          sMag (int): Strong motor magnitude.
+          wMag (int): Weak motor magnitude to start from.
+          step (int): Initial step of the weak motor magnitude.
+          precision (int): Smallest step of the weak motor
+            magnitude. Defaults to an eighth of `step`.
+          reversals (int): Reversals to make at the smallest step.
+            Defaults to the `Staircase` default, 4.
+          maxTrials (int): Most presentations to make. Defaults to
+            the `Staircase` default, 40.
+          stickFrames (int): Frames to sample the resting stick for
+            after the west button is pressed. Defaults to 60.
+          deadzoneSD (float): Dead zone of each axis, in standard
+            deviations of its resting noise. Defaults to 4.
+
+        Raises:
+          ConnectionError: The joystick was unplugged; calibration
+            stops without changing its magnitude or offset.
+        """
+
+        def calibrateRumble(sMag, staircase):
+            """Interactive calibration of vibration strength
+
+            Raises:
+              ValueError: Both motors may not be set to zero.
+            """
+            for wMag in staircase:
+                self.joystick.calibrateRumble(sMag, wMag)
+                button = self.waitForButton((0, 1), display=self.calibrateRumbleDisplay)
+                self._calibrationStep(sMag, staircase, button == 0)
+                self.waitForRelease(display=self.calibrateRumbleDisplay)
+                self._idle(50, self.calibrateRumbleDisplay)
+            self._calibrationResult(sMag, staircase)
+
+        def calibrateStick():
+            """Calibrate the stick's resting position.
+
+            Currently, the procedure is to move the right stick around, release,
+              and press the West button (square on PS, X on MS). Future
+              implementations may support other sticks or specified buttons
+            """
+
+            self.waitForButton((3,), display=self.calibrateStickDisplay)
+            stats, sample = self._restSampler()
+            sample(0)
+            self.run(stickFrames, sample)
+            self._restCalibration(stats, deadzoneSD)
+
+        try:
+            stickFrames = kwargs["stickFrames"]
+        except KeyError:
+            stickFrames = 60
+        try:
+            deadzoneSD = kwargs["deadzoneSD"]
+        except KeyError:
+            deadzoneSD = 4.0
+
+        calibrateRumble(*self._rumbleStaircase(kwargs))
+        calibrateStick()
+
+    def _rumbleStaircase(self, kwargs):
+        """The strong magnitude and weak magnitude `Staircase` for
+        the calibration keyword arguments."""
+        try:
+            sMag = kwargs["sMag"]
+        except KeyError:
+            sMag = 0x0000
+        try:
+            wMag = kwargs["wMag"]
+        except KeyError:
+            wMag = 0x0F00
+        try:
+            step = kwargs["step"]
+        except KeyError:
+            step = 0x0400
+        try:
+            precision = kwargs["precision"]
+        except KeyError:
+            precision = None
+        # Left to the staircase's own defaults unless given
+        limits = {}
+        try:
+            limits["maxTrials"] = kwargs["maxTrials"]
+        except KeyError:
+            pass
+        try:
+            limits["finalReversals"] = kwargs["reversals"]
+        except KeyError:
+            pass
+        # The weak motor only stops at zero if the strong one is on
+        minValue = 0 if sMag > 0 else 1
+        staircase = Staircase(wMag, step, precision, minValue=minValue, **limits)
+        return sMag, staircase
+
+    def _calibrationStep(self, sMag, staircase, detected):
+        """Update the staircase with a response and log the step."""
+        wMag, step = staircase.value, staircase.step
+        reversal = staircase.update(detected)
+        self.log_data(
+            {
+                "calibration": "rumble",
+                "step": len(staircase.history),
+                "sMag": sMag,
+                "wMag": wMag,
+                "step_size": step,
+                "detected": detected,
+                "reversal": reversal,
+            }
+        )
+
+    def _calibrationResult(self, sMag, staircase):
+        """Use the staircase's threshold and log it."""
+        wMag = round(staircase.estimate())
+        self.joystick.setMagnitudes(sMag, wMag)
+        self.log_data(
+            {
+                "calibration": "rumble",
+                "sMag": sMag,
+                "wMag": wMag,
+                "presentations": len(staircase.history),
+                "reversals": list(staircase.reversals),
+            }
+        )
+
+    def _rawStick(self):
+        """All axes of the joystick without its offset."""
+        axes = np.asarray(self.joystick.getAllAxes(), dtype=float)
+        offset = getattr(self.joystick, "offset", None)
+        return axes if offset is None else axes + offset
+
+    def _restSampler(self):
+        """A `RunningStats` and a `run` callback that shows the stick
+        calibration display and adds the raw axes to it."""
+        stats = RunningStats(len(self.joystick.getAllAxes()))
+
+        def sample(frameN):
+            self.calibrateStickDisplay()
+            stats.add(self._rawStick())
+
+        return stats, sample
+
+    def _restCalibration(self, stats, deadzoneSD=4.0, minDeadzone=0.02):
+        """Set the offset and dead zones from resting statistics
+        and start tracking drift."""
+        self.joystick.setOffset(stats.mean)
+        deadzone = np.clip(deadzoneSD * stats.std, minDeadzone, 0.5)
+        self.stickDeadzone = tuple(deadzone.tolist())
+        # Accept rest samples a little outside the dead zone so drift
+        #  that has carried the rest position past it is still seen.
+        self._restZone = 2 * deadzone
+        self.drift = RunningStats(stats.size, halfLife=self.frameRate * 10)
+        self.log_data(
+            {
+                "calibration": "stick",
+                "offset": stats.mean.tolist(),
+                "noise": stats.std.tolist(),
+                "deadzone": list(self.stickDeadzone),
+                "samples": stats.count,
+            }
+        )
+
+    def _sampleRest(self):
+        """Add the raw axes to `drift` if every axis is at rest."""
+        axes = np.asarray(self.joystick.getAllAxes(), dtype=float)
+        if np.all(np.abs(axes) <= self._restZone):
+            offset = getattr(self.joystick, "offset", None)
+            self.drift.add(axes if offset is None else axes + offset)
+
+    def recalibrateStick(self, minSamples=30):
+        """Move the stick offset to where the controller has been
+        resting since calibration.
+
+        Call this between trials; the rest position is tracked on
+        every flip while all axes are inside their dead zones, so
+        no calibration screen is needed. The dead zones are kept.
+
+        Keyword arguments:
+          minSamples (int): Resting samples needed to recalibrate.
+
+        Returns:
+          True if the offset was updated.
+        """
+        if self.drift is None or self.drift.count < minSamples:
+            return False
+        self.joystick.setOffset(self.drift.mean.copy())
+        return True
+
+    def checkHold(self):
+        """Wait until every button is released.
+
+        As with every `waitForInput`, the window has flipped since
+        the release by the time this returns, so pyglet's state
+        agrees with the device's.
+        """
+        self.waitForRelease()
+
+    def waitForInput(self, condition=None, timeout=None, display=None):
+        """Show a static screen until the joystick's input changes.
+
+        `display` is called and the window flipped once, then the
+        thread sleeps until `condition` holds (see
+        `HapticDevice.waitForInput`), so nothing is redrawn while
+        waiting. Joysticks without an event stream, such as a
+        `ReplayDevice`, only change when the window flips and are
+        checked once per frame instead, redrawing `display` each time.
+
+        A joystick that is not being read by a `DeviceGroup` only
+        updates pyglet's state when the window flips, so the screen
+        is flipped once more after the wait; until then pyglet could
+        still report, say, a button that was just released.
+
+        Keyword arguments:
+          condition (function): Called with the joystick; the wait
+            ends when it returns anything but None. Defaults to
+            waiting for any input.
+          timeout (float): Seconds to wait, or None for no limit.
+          display (function): Draws the screen shown while waiting.
+
+        Returns:
+          The value returned by `condition`, or None on timeout.
+
+        Raises:
+          ConnectionError: The joystick is or becomes unplugged.
+        """
+        if display is not None:
+            display()
+        self.flip()
+        try:
+            wait = self.joystick.waitForInput
+        except AttributeError:
+            return self._waitFrames(condition, timeout, display)
+        result = wait(condition, timeout)
+        if getattr(self.joystick, "group", None) is None:
+            if display is not None:
+                display()
+            self.flip()
+        return result
+
+    def waitForButton(self, buttons=None, timeout=None, display=None):
+        """`waitForInput` for a press of one of `buttons`, or any
+        button by default. Returns the button's index."""
+        return self.waitForInput(_pressed(buttons), timeout, display)
+
+    def waitForRelease(self, timeout=None, display=None):
+        """`waitForInput` for every button to be released."""
+        return self.waitForInput(_released, timeout, display)
+
+    def _waitFrames(self, condition, timeout, display):
+        """`waitForInput` for joysticks that only change on flips."""
+        if condition is None:
+            start = (self.joystick.getAllButtons(), list(self.joystick.getAllAxes()))
+
+            def condition(device):
+                if (device.getAllButtons(), list(device.getAllAxes())) != start:
+                    return True
+
+        frames = math.inf if timeout is None else math.ceil(timeout * self.frameRate)
+        frameN = 0
+        while True:
+            result = condition(self.joystick)
+            if result is not None or frameN >= frames:
+                return result
+            if display is not None:
+                display()
+            self.flip()
+            frameN += 1
+
+    def _idle(self, frames, display=None):
+        """Show a static screen for `frames` frames.
+
+        The window is flipped once and the thread sleeps for the
+        rest, unless the joystick only changes on flips.
+        """
+        if not hasattr(self.joystick, "waitForInput"):
+
+            def draw(frameN):
+                if display is not None:
+                    display()
+
+            self.run(frames, draw)
+            return
+        if display is not None:
+            display()
+        start = self.flip()
+        time.sleep(max(start + frames / self.frameRate - time.monotonic(), 0))
+
+    def _holdFrames(self):
+        """Flip until every button is released, yielding after each flip."""
+        while True:
+            if True not in self.joystick.getAllButtons():
+                break
+            yield self.flip()
+
+    def on_run_end(self):
+        """Callback for end of a run loop. Replace with own method."""
+        pass
+
+    def on_run_loop(self, frame):
+        """Callback at start of every run loop."""
+        pass
+
+    def run(self, n=1, func=None, funcargs=[], funckwargs={}, recorder=None):
+        """Run the provided function in a loop.
+
+        This method abstracts running `visual.window.flip` loops and
+            the experiment. T
+          drawing objects to the screen. Th provided function is run
+          on each loop and is provided the `window` object and the
+          frame number (starting from 0). These can be used to do
+          more fine-grained editing within the callback.
+
+        The callback function should return a list of objects to
+          draw in the order they should be drawn, or None if there
+          is nothing to draw.
+
+        Warning:
+          The callback function should not flip the window.
+            Doing so will introduce errors into your experiment timing.
+
+        Keyword arguments:
+          n (int): The number of frames to run. On a monitor with a
+            60Hz refresh rate, each frame corresponds to roughly 17ms.
+            Defaults to 1.
+          func (function): A callback function to run on each loop
+            pass. The first argument to this callback will be the
+            the frame number. This function should return a list of
+            objects to draw.
+          funcargs (list): Positional arguments for func.
+          funckwargs (dictionary): Keyword arguments for func.
+          recorder (FrameRecorder, optional): If given, the frame
+            number, flip time, stick position and button state
+            are recorded into it after every flip.
+
+        If `frameTimer` is set, the time spent in each stage of
+          every frame is recorded into it and its summary is stored
+          in `runTiming` when the loop ends.
+        """
+        for flipTime in self._runFrames(n, func, funcargs, funckwargs, recorder):
+            if flipTime is None:
+                self.checkHold()
+
+    def _runFrames(self, n, func, funcargs, funckwargs, recorder):
+        """The frames of `run`, yielding the time of each flip.
+
+        None is yielded when `on_run_loop` stops the loop, for the
+        caller to wait until the buttons are released.
+        """
+        timer = self.frameTimer
+        if timer is not None:
+            timer.reset()
+        clock = time.perf_counter
+        for frameN in range(n):
+            t0 = clock()
+            try:
+                self.on_run_loop(frameN)
+            except StopIteration:
+                yield None
+                break
+            t1 = t2 = clock()
+            if func is not None:
+                try:
+                    draw = func(frameN, *funcargs, **funckwargs)
+                except StopIteration:
+                    break
+                t2 = clock()
+                if draw is not None:
+                    for obj in draw:
+                        obj.draw()
+            t3 = clock()
+            flipTime = self.flip()
+            if timer is not None:
+                timer.frame(t1 - t0, t2 - t1, t3 - t2, clock() - t3, flipTime)
+            if recorder is not None:
+                recorder.record(
+                    frameN,
+                    flipTime,
+                    self.stickPos(),
+                    buttonMask(self.joystick.getAllButtons()),
+                )
+            yield flipTime
+        if timer is not None:
+            self.runTiming = timer.summary()
+        self.on_run_end()
+
+    async def flipAsync(self):
+        """Flip the window, then let other tasks run.
+
+        Input waiters are checked after every flip, so conditions
+        on pyglet's state, which only changes when the window flips,
+        are seen on the frame they become true.
+
+        Returns:
+          The flip time, as for `flip`.
+        """
+        t = self.flip()
+        self._checkWaiters()
+        await asyncio.sleep(0)
+        return t
+
+    async def runAsync(self, n=1, func=None, funcargs=[], funckwargs={}, recorder=None):
+        """Run the frames of `run` from a coroutine.
+
+        The loop yields to the event loop after every flip, so other
+        tasks, such as one awaiting `waitForButtonAsync` or a rumble
+        pattern, run between frames. `func` is called as for `run`
+        and should return promptly; long work belongs in a task of
+        its own.
+        """
+        for flipTime in self._runFrames(n, func, funcargs, funckwargs, recorder):
+            if flipTime is None:
+                await self.checkHoldAsync()
+                continue
+            self._checkWaiters()
+            await asyncio.sleep(0)
+
+    async def checkHoldAsync(self):
+        """`checkHold`, yielding to the event loop between flips."""
+        for _ in self._holdFrames():
+            self._checkWaiters()
+            await asyncio.sleep(0)
+
+    async def calibrateAsync(self, **kwargs):
+        """`calibrate`, yielding to the event loop between flips.
+
+        Takes the same keyword arguments, and raises the same
+        errors, as `calibrate`.
+        """
+
+        def pressed(device):
+            buttons = device.getAllButtons()
+            if buttons[0] or buttons[1]:
+                return bool(buttons[0])
+
+        sMag, staircase = self._rumbleStaircase(kwargs)
+        for wMag in staircase:
+            self.joystick.calibrateRumble(sMag, wMag)
+            detected = await self._showUntil(self.calibrateRumbleDisplay, pressed)
+            self._calibrationStep(sMag, staircase, detected)
+            await self._showUntil(self.calibrateRumbleDisplay, _released)
+            await self.runAsync(50, lambda frameN: self.calibrateRumbleDisplay())
+        self._calibrationResult(sMag, staircase)
+
+        def westPressed(device):
+            if device.getAllButtons()[3]:
+                return True
+
+        await self._showUntil(self.calibrateStickDisplay, westPressed)
+        try:
+            stickFrames = kwargs["stickFrames"]
+        except KeyError:
+            stickFrames = 60
+        try:
+            deadzoneSD = kwargs["deadzoneSD"]
+        except KeyError:
+            deadzoneSD = 4.0
+        stats, sample = self._restSampler()
+        sample(0)
+        await self.runAsync(stickFrames, sample)
+        self._restCalibration(stats, deadzoneSD)
+
+    async def _showUntil(self, display, condition):
+        """Call `display` and flip every frame until `condition` holds."""
+        waiter = asyncio.ensure_future(self.waitForInputAsync(condition))
+        try:
+            while not waiter.done():
+                display()
+                await self.flipAsync()
+            return waiter.result()
+        finally:
+            waiter.cancel()
+
+    async def waitForInputAsync(self, condition, timeout=None):
+        """Wait until a condition on the joystick holds.
+
+        The condition is checked after every flip and, when the
+        joystick is a `HapticDevice`, as soon as its events arrive,
+        so a response is noticed without waiting for the next frame.
+        A `HapticDevice` that is not already being read is read
+        from the running event loop until no waits are left, and
+        then returns to its own state.
+
+        Arguments:
+          condition (function): Called with the joystick; the wait
+            ends when it returns anything but None.
+
+        Keyword arguments:
+          timeout (float): Seconds to wait, or None for no limit.
+
+        Returns:
+          The value returned by `condition`, or None on timeout.
+
+        Raises:
+          ConnectionError: The joystick is or becomes unplugged.
+        """
+        loop = asyncio.get_running_loop()
+        self._watchInput(loop)
+        future = loop.create_future()
+        waiter = (condition, future)
+        self._waiters.append(waiter)
+        self._checkWaiters()
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._waiters.remove(waiter)
+            if not self._waiters:
+                self._unwatchInput()
+
+    async def waitForButtonAsync(self, buttons=None, timeout=None):
+        """Wait for a button press.
+
+        Keyword arguments:
+          buttons (iterable): Button indices to wait for. Defaults
+            to any button.
+          timeout (float): Seconds to wait, or None for no limit.
+
+        Returns:
+          The index of the pressed button, or None on timeout.
+        """
+
+        return await self.waitForInputAsync(_pressed(buttons), timeout)
+
+    async def waitForReleaseAsync(self, timeout=None):
+        """Wait until no button is held.
+
+        Returns:
+          True once every button is released, or None on timeout.
+        """
+        return await self.waitForInputAsync(_released, timeout)
+
+    def _checkWaiters(self):
+        connected = getattr(self.joystick, "connected", True)
+        for condition, future in self._waiters:
+            if future.done():
+                continue
+            if not connected:
+                future.set_exception(ConnectionError("The joystick is unplugged"))
+                continue
+            result = condition(self.joystick)
+            if result is not None:
+                future.set_result(result)
+
+    def _watchInput(self, loop):
+        """Check the waiters as the joystick's events arrive in `loop`."""
+        if self._inputLoop is loop:
+            return
+        self._inputLoop = loop
+        device = self.joystick
+        if not hasattr(device, "startReader"):
+            return
+        group = device.group
+        if group is None:
+            device.startReader(loop=loop)
+            group = device.group
+            self._inputReader = True
+        elif group._loop is not None:
+            # Attached to the loop of an earlier asyncio.run
+            group.attach(loop)
+        if self._inputEvents not in group.onEvents:
+            group.onEvents.append(self._inputEvents)
+            group.onDisconnect.append(self._inputEvents)
+
+    def _unwatchInput(self):
+        """Stop watching the joystick for the waiters' event loop.
+
+        A reader started by `_watchInput` is stopped, so the
+        joystick is not left reading from a loop that may close.
+        """
+        if self._inputLoop is None:
+            return
+        self._inputLoop = None
+        group = getattr(self.joystick, "group", None)
+        if group is not None and self._inputEvents in group.onEvents:
+            group.onEvents.remove(self._inputEvents)
+            group.onDisconnect.remove(self._inputEvents)
+        if self._inputReader:
+            self._inputReader = False
+            self.joystick.stopReader()
+
+    def _inputEvents(self, device):
+        try:
+            self._inputLoop.call_soon_threadsafe(self._checkWaiters)
+        except RuntimeError:
+            # The loop has closed
+            pass
+
+    def compileTimeline(self, timeline):
+        """Compile a `Timeline` for this experiment's frame rate.
+
+        Returns:
+          A `CompiledTimeline` to pass to `runTimeline`.
+        """
+        return CompiledTimeline(timeline, self.frameRate)
+
+    def runTimeline(self, timeline, trial=None, recorder=None):
+        """Run a compiled trial timeline.
+
+        Each frame draws the current phase's stims and flips.
+        Phases end when their frame count runs out or their
+        `until` condition is met, and the timeline ends after the
+        last phase, on a response, or at the timeout. Nothing is
+        raised to change phase and nothing is recompiled per frame.
+
+        When `trial` is given, the onset of each phase is marked
+        under the phase's `mark` (see `Trial.markOnset`) and the
+        response is stored as ``data["response"]`` and marked as
+        ``"response"`` (see `Trial.markResponse`). On timeout
+        ``timing["response"]`` is the last frame and the response
+        is the timeline's `timeoutResponse`.
+
+        Stale `Layer` objects in the timeline are captured before
+        the first frame. Unlike `run`, the `on_run_loop` hook is not
+        called. With `frameTimer` set, phase bookkeeping is timed as
+        the ``loop`` stage and ``callback`` is always zero.
+
+        Arguments:
+          timeline (CompiledTimeline): From `compileTimeline`.
+
+        Keyword arguments:
+          trial (Trial): Trial to record timing and responses in.
+          recorder (FrameRecorder): See `run`.
+
+        Returns:
+          The response, or the timeline's `timeoutResponse`.
+        """
+        phases = timeline.phases
+        frames = timeline.frames
+        draws = timeline.draws
+        # Capture stale layers now rather than on a timed frame
+        for draw in draws:
+            for obj in draw:
+                if isinstance(obj, Layer):
+                    obj.refresh()
+        responses = timeline.responses
+        timeout = timeline.timeout
+        last = len(phases) - 1
+        timer = self.frameTimer
+        if timer is not None:
+            timer.reset()
+        clock = time.perf_counter
+
+        p = 0
+        frameN = 0
+        response = timeline.timeoutResponse
+        button = None
+        phaseEnd = self._enterPhase(phases[0], frames[0], 0, trial)
+        while True:
+            t0 = clock()
+            if frameN >= timeout:
+                break
+            until = phases[p].until
+            if frameN >= phaseEnd or (until is not None and until()):
+                if phases[p].onEnd is not None:
+                    phases[p].onEnd()
+                if p == last:
+                    break
+                p += 1
+                phaseEnd = self._enterPhase(phases[p], frames[p], frameN, trial)
+                continue
+            if responses[p]:
+                pressed = self.joystick.getAllButtons()
+                for b, label in responses[p]:
+                    if pressed[b]:
+                        button = b
+                        response = label
+                        break
+                if button is not None:
+                    break
+            t1 = clock()
+            for obj in draws[p]:
+                obj.draw()
+            t2 = clock()
+            flipTime = self.flip()
+            if timer is not None:
+                timer.frame(t1 - t0, 0.0, t2 - t1, clock() - t2, flipTime)
+            if recorder is not None:
+                recorder.record(
+                    frameN,
+                    flipTime,
+                    self.stickPos(),
+                    buttonMask(self.joystick.getAllButtons()),
+                )
+            frameN += 1
+
+        if timer is not None:
+            self.runTiming = timer.summary()
+        if trial is not None:
+            trial.data["data"]["response"] = response
+            if button is None:
+                trial.data["timing"]["response"] = frameN
+            else:
+                trial.markResponse("response", frameN, button)
+        if button is not None and timeline.hold:
+            self.checkHold()
+        return response
+
+    def _enterPhase(self, phase, frames, frameN, trial):
+        """Start `phase` on `frameN`; returns the frame it ends on."""
+        if trial is not None and phase.mark is not None:
+            trial.markOnset(phase.mark, frameN)
+        if phase.onStart is not None:
+            phase.onStart()
+        if phase.onFlip is not None:
+            self.window.callOnFlip(phase.onFlip)
+        return frameN + frames
+
+    def instrument(self, enable=True):
+        """Turn frame-timing instrumentation of `run` on or off.
+
+        See `FrameTimer`. Dropped frames are judged against the
+        window's refresh period, ``1 / frameRate``.
+        """
+        if enable:
+            self.frameTimer = FrameTimer(refreshPeriod=1.0 / self.frameRate)
+        else:
+            self.frameTimer = None
+
+    def stickPos(
+        self, start=-3, stop=-1, tolerance=0.1, scale=0.25, curve=1.0, rescale=False
+    ):
+        """Provide the stick position, inverting y-axis if needed.
+
+        The axes are processed by a `StickProcessor` with a radial
+        dead zone of radius `tolerance`, or, once `calibrate` has
+        measured the resting noise, the per-axis `stickDeadzone`.
+        The processor is only rebuilt when the arguments change.
+        With `rescale` the output grows from zero at the dead zone's
+        edge instead of jumping to ``tolerance * scale``.
+        """
+        deadzone = tolerance
+        if self.stickDeadzone is not None:
+            deadzone = self.stickDeadzone[start:stop]
+        key = (start, stop, deadzone, scale, curve, rescale, self.invert_y_axis)
+        if key != self._stickKey:
+            invert = [i == 1 and self.invert_y_axis for i in range(stop - start)]
+            self._stick = StickProcessor(
+                start,
+                stop,
+                invert=invert,
+                deadzone=deadzone,
+                scale=scale,
+                curve=curve,
+                rescale=rescale,
+            )
+            self._stickKey = key
+        return self._stick.sample(self.joystick.getAllAxes())
+
+
+class Staircase:
+    """An adaptive up/down staircase for finding a threshold.
+
+    Each trial presents `value`. A detected stimulus moves the
+    value down after `down` detections in a row and a missed one
+    moves it up, so a 1-down staircase converges on the 50% point
+    and a 2-down one on about 71%. The step is halved at every
+    reversal of direction until it reaches `precision`, and the
+    staircase finishes after `finalReversals` reversals at that
+    step, or after `maxTrials` trials. The threshold is estimated
+    from the reversals at the final step, so it is known to about
+    `precision` rather than to the coarse early steps.
+
+    Use it as an iterator of the values to present::
+
+        staircase = Staircase(0x0F00, 0x0400, precision=0x0080)
+        for magnitude in staircase:
+            staircase.update(present(magnitude))
+
+    Attributes:
+      value (int or float): The next value to present.
+      step (int or float): The current step size.
+      history (list): ``(value, detected, step, reversal)`` for each
+        trial.
+      reversals (list): The values at which the direction reversed.
+      finalReversals (int): Reversals needed at the smallest step.
+    """
+
+    def __init__(
+        self,
+        start,
+        step,
+        precision=None,
+        minValue=0,
+        maxValue=0xFFFF,
+        maxTrials=40,
+        down=1,
+        finalReversals=4,
+    ):
+        """Create a staircase.
+
+        Arguments:
+          start (int or float): The first value presented.
+          step (int or float): The initial step size.
+
+        Keyword arguments:
+          precision (int or float): The smallest step; halving
+            stops here. Defaults to an eighth of `step`.
+          minValue (int or float): Lowest value presented.
+          maxValue (int or float): Highest value presented.
+          maxTrials (int): Stop after this many trials regardless.
+          down (int): Detections in a row needed to step down.
+          finalReversals (int): Reversals to make at the smallest
+            step before finishing.
+
+        Raises:
+          ValueError: If `step` or `precision` is not positive.
+        """
+        if step <= 0:
+            raise ValueError("Staircase step must be positive")
+        if precision is None:
+            precision = step // 8 if isinstance(step, int) else step / 8
+        if precision <= 0:
+            raise ValueError("Staircase precision must be positive")
+        self.value = start
+        self.step = step
+        self.precision = precision
+        self.minValue = minValue
+        self.maxValue = maxValue
+        self.maxTrials = maxTrials
+        self.down = down
+        self.finalReversals = finalReversals
+        self.history = []
+        self.reversals = []
+        self._final = 0
+        self._direction = 0
+        self._run = 0
+        self._integer = isinstance(start, int) and isinstance(step, int)
+
+    def finished(self):
+        """Whether the threshold has been found to `precision` or
+        the trial limit reached."""
+        if len(self.history) >= self.maxTrials:
+            return True
+        return self._final >= self.finalReversals
+
+    def update(self, detected):
+        """Record the response to `value` and choose the next value.
+
+        Arguments:
+          detected (bool): Whether the stimulus was detected.
+
+        Returns:
+          True if the response reversed the staircase's direction.
+        """
+        step = self.step
+        if detected:
+            self._run += 1
+            direction = -1 if self._run >= self.down else 0
+        else:
+            self._run = 0
+            direction = 1
+        if direction:
+            self._run = 0
+        reversal = direction != 0 and self._direction not in (0, direction)
+        self.history.append((self.value, detected, step, reversal))
+        if reversal:
+            self.reversals.append(self.value)
+            if step <= self.precision:
+                self._final += 1
+            half = step // 2 if self._integer else step / 2
+            self.step = max(half, self.precision)
+        if direction:
+            self._direction = direction
+            value = self.value + direction * self.step
+            self.value = min(max(value, self.minValue), self.maxValue)
+        return reversal
+
+    def estimate(self, last=None):
+        """Estimate the threshold.
+
+        Keyword arguments:
+          last (int): Number of final reversals to average. Defaults
+            to those made at the smallest step, or the last four if
+            the staircase stopped before reaching it.
+
+        Returns:
+          The mean of the last `last` reversal values, or the
+          current value if there has been no reversal.
+        """
+        if not self.reversals:
+            return self.value
+        if last is None:
+            last = self._final or 4
+        values = self.reversals[-last:]
+        return sum(values) / len(values)
+
+    def __iter__(self):
+        while not self.finished():
+            yield self.value
+
+
+class RunningStats:
+    """Running mean and variance of a stream of samples.
+
+    Samples are vectors of `size` values, folded in one at a time
+    with Welford's update, so memory stays constant however long
+    the stream. With `halfLife` set, older samples are weighted
+    down exponentially instead, so the statistics follow slow
+    drift rather than averaging over the whole session.
+
+    Attributes:
+      size (int): Values per sample.
+      halfLife (float): Samples after which a sample's weight has
+        halved, or None to weight all samples equally.
+      count (int): Number of samples added.
+      mean (numpy.ndarray): Mean of each value.
+    """
+
+    def __init__(self, size, halfLife=None):
+        if halfLife is not None and halfLife <= 0:
+            raise ValueError(f"Half-life must be positive, got {halfLife}")
+        self.size = size
+        self.halfLife = halfLife
+        self._alpha = None if halfLife is None else 1.0 - 0.5 ** (1.0 / halfLife)
+        self.reset()
+
+    def reset(self):
+        """Forget every sample."""
+        self.count = 0
+        self.mean = np.zeros(self.size)
+        self._m2 = np.zeros(self.size)
+
+    def add(self, sample):
+        """Fold one sample into the statistics."""
+        x = np.asarray(sample, dtype=float)
+        self.count += 1
+        delta = x - self.mean
+        if self._alpha is None:
+            self.mean += delta / self.count
+            self._m2 += delta * (x - self.mean)
+        elif self.count == 1:
+            self.mean = x.copy()
+        else:
+            step = self._alpha * delta
+            self.mean += step
+            self._m2 = (1.0 - self._alpha) * (self._m2 + delta * step)
+
+    @property
+    def variance(self):
+        """Sample variance of each value; zero before two samples."""
+        if self.count < 2:
+            return np.zeros(self.size)
+        if self._alpha is None:
+            return self._m2 / (self.count - 1)
+        return self._m2.copy()
+
+    @property
+    def std(self):
+        """Standard deviation of each value."""
+        return np.sqrt(self.variance)
+
+
+class StickProcessor:
+    """Turn raw axis readings into stick positions.
+
+    The axes ``start:stop`` are taken from each sample, then the
+    offset is subtracted, axes are inverted, a radial dead zone is
+    applied and the distance from the centre is put through a
+    response curve and scaled. Positions inside the dead zone are
+    zero; outside it they are the deflection raised to the power
+    `curve` and times `scale`, or, with `rescale`, grow from zero
+    at the zone's edge to `scale` at full deflection.
+
+    Calibration is checked once when the processor is created.
+    Calling the processor is a handful of NumPy operations, so a
+    whole block of samples (shape ``(n, axes)``) costs about the
+    same as a single sample, for offline use on recorded axes.
+    `sample` processes one live sample, such as the output of
+    `HapticDevice.getAllAxes`, in plain Python, which is several
+    times faster than NumPy for a single sample.
+
+    Attributes:
+      start (int): First axis of the stick.
+      stop (int): One past the last axis of the stick.
+    """
+
+    def __init__(
+        self,
+        start=-3,
+        stop=-1,
+        offset=None,
+        invert=None,
+        deadzone=0.1,
+        scale=0.25,
+        curve=1.0,
+        rescale=False,
+    ):
+        """Create a processor.
+
+        Keyword arguments:
+          start (int): First axis of the stick in a sample.
+          stop (int): One past the last axis. `start` and `stop`
+            must both be negative or both be non-negative.
+          offset (sequence): Resting position of each stick axis.
+          invert (sequence): Whether to invert each stick axis.
+          deadzone (float or sequence): Dead zone radius. A value
+            per axis makes the dead zone an ellipse.
+          scale (float): Output at full deflection.
+          curve (float): Exponent of the response curve. Values
+            above 1 give finer control near the centre.
+          rescale (bool): Measure deflection from the dead zone's
+            edge, so the output starts at zero there.
+
+        Raises:
+          ValueError: If any of the calibration is invalid.
+        """
+        if (start < 0) != (stop < 0) or stop <= start:
+            raise ValueError(f"Invalid stick axes {start}:{stop}")
+        n = stop - start
+        self.start = start
+        self.stop = stop
+        self._offset = self._perAxis("offset", offset, n, 0.0)
+        self._sign = np.where(self._perAxis("invert", invert, n, False), -1.0, 1.0)
+        self._deadzone = self._perAxis("deadzone", deadzone, n, 0.0)
+        if np.any(self._deadzone < 0) or np.any(self._deadzone >= 1):
+            raise ValueError(f"Dead zone must be in [0, 1), got {deadzone}")
+        if np.any(self._deadzone == 0):
+            if np.any(self._deadzone):
+                raise ValueError("Dead zone must be zero on all axes or none")
+            self._deadzone = None
+        if curve <= 0:
+            raise ValueError(f"Curve must be positive, got {curve}")
+        self.scale = float(scale)
+        self.curve = float(curve)
+        self.rescale = bool(rescale)
+        # Plain copies for `sample`
+        self._offsets = self._offset.tolist()
+        self._signs = self._sign.tolist()
+        self._deadzones = None if self._deadzone is None else self._deadzone.tolist()
+
+    @staticmethod
+    def _perAxis(name, value, n, default):
+        if value is None:
+            value = default
+        array = np.broadcast_to(np.asarray(value, dtype=float), (n,))
+        if not np.all(np.isfinite(array)):
+            raise ValueError(f"{name} must be finite, got {value}")
+        return array.copy()
+
+    def __call__(self, samples):
+        """Process full samples of all axes."""
+        samples = np.asarray(samples, dtype=float)
+        return self.process(samples[..., self.start : self.stop])
+
+    def sample(self, sample):
+        """Process one full sample of all axes; returns a tuple."""
+        axes = sample[self.start : self.stop]
+        tolist = getattr(axes, "tolist", None)
+        if tolist is not None:
+            # NumPy scalars are slow in plain arithmetic
+            axes = tolist()
+        x = [(a - o) * s for a, o, s in zip(axes, self._offsets, self._signs)]
+        norm = math.sqrt(sum(v * v for v in x))
+        if self._deadzones is None:
+            dead = 0.0
+        elif norm == 0.0:
+            return (0.0,) * len(x)
+        else:
+            dead = norm / math.sqrt(
+                sum((v / d) ** 2 for v, d in zip(x, self._deadzones))
+            )
+        if norm <= dead:
+            return (0.0,) * len(x)
+        if self.rescale:
+            gain = min((norm - dead) / (1.0 - dead), 1.0) ** self.curve
+        else:
+            gain = norm ** self.curve
+        k = gain * self.scale / norm
+        return tuple(v * k for v in x)
+
+    def process(self, axes):
+        """Process samples that only hold the stick's axes."""
+        x = (np.asarray(axes, dtype=float) - self._offset) * self._sign
+        norm = np.sqrt(np.sum(x * x, axis=-1, keepdims=True))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self._deadzone is None:
+                dead = 0.0
+            else:
+                # Distance to the dead zone's edge along the stick's
+                #  direction; equals the radius for a circular zone.
+                dead = norm / np.sqrt(
+                    np.sum((x / self._deadzone) ** 2, axis=-1, keepdims=True)
+                )
+            if self.rescale:
+                gain = np.clip((norm - dead) / (1.0 - dead), 0.0, 1.0) ** self.curve
+            else:
+                gain = norm ** self.curve
+            return np.where(norm > dead, x * (gain * self.scale / norm), 0.0)
+
+
+class Phase:
+    """One phase of a trial `Timeline`.
+
+    Attributes:
+      name (string): Name of the phase.
+      duration (float): Seconds the phase lasts, or None to last
+        until `until` is met or the timeline times out.
+      draw (list): Stims drawn on every frame of the phase.
+      responses (dictionary): Maps button indices to the response
+        they give while the phase runs. A response ends the trial.
+      until (function): Called without arguments every frame;
+        the phase ends early when it returns True.
+      onStart (function): Called without arguments when the
+        phase begins, before its first frame is drawn.
+      onFlip (function): Called without arguments as the phase's
+        first frame is flipped onto the screen, the moment its
+        onset is stamped. Start sounds here rather than in
+        `onStart`, so their onset is not up to a frame early.
+      onEnd (function): Called without arguments when the
+        phase ends, unless the trial ends within it.
+      mark (string): Timing key for the phase's onset, see
+        `Trial.markOnset`. Defaults to `name`; None to skip.
+    """
+
+    _UNSET = object()
+
+    def __init__(
+        self,
+        name,
+        duration=None,
+        draw=(),
+        responses=None,
+        until=None,
+        onStart=None,
+        onEnd=None,
+        mark=_UNSET,
+        onFlip=None,
+    ):
+        self.name = name
+        self.duration = duration
+        self.draw = list(draw)
+        self.responses = dict(responses or {})
+        self.until = until
+        self.onStart = onStart
+        self.onEnd = onEnd
+        self.mark = name if mark is self._UNSET else mark
+        self.onFlip = onFlip
+
+
+class Timeline:
+    """Declarative description of a trial as a list of phases.
+
+    Attributes:
+      phases (list): The `Phase` objects, in order.
+      timeout (float): Seconds after which the trial ends without
+        a response, or None for no limit.
+      timeoutResponse: Response recorded when the trial times out
+        or its last phase ends without a response.
+      hold (bool): After a response, wait for all buttons to be
+        released before returning (see `Experiment.checkHold`).
+    """
+
+    def __init__(self, phases, timeout=None, timeoutResponse="NA", hold=True):
+        """Create a timeline.
+
+        Arguments:
+          phases (list): `Phase` objects, in order.
+
+        Keyword arguments:
+          timeout (float): See `timeout`.
+          timeoutResponse: See `timeoutResponse`.
+          hold (bool): See `hold`.
+
+        Raises:
+          ValueError: If there are no phases or a duration is negative.
+        """
+        self.phases = list(phases)
+        if not self.phases:
+            raise ValueError("A timeline needs at least one phase")
+        for phase in self.phases:
+            if phase.duration is not None and phase.duration < 0:
+                raise ValueError(f"Phase {phase.name} has a negative duration")
+        self.timeout = timeout
+        self.timeoutResponse = timeoutResponse
+        self.hold = hold
+
+
+class CompiledTimeline:
+    """A `Timeline` converted to frame counts and lookup tables.
+
+    Built by `Experiment.compileTimeline` and run by
+    `Experiment.runTimeline`. Durations become whole frames at
+    the experiment's frame rate, open-ended phases and a missing
+    timeout become an infinite frame count, and each phase's draw
+    list and response buttons are frozen into tuples.
+
+    Attributes:
+      phases (tuple): The phases.
+      frames (tuple): Frames each phase lasts.
+      draws (tuple): Stims to draw in each phase.
+      responses (tuple): ``(button, response)`` pairs per phase.
+      timeout (float): Frame the timeline times out on.
+      timeoutResponse: See `Timeline`.
+      hold (bool): See `Timeline`.
+    """
+
+    def __init__(self, timeline, frameRate):
+        def toFrames(seconds):
+            return float("inf") if seconds is None else round(seconds * frameRate)
+
+        self.phases = tuple(timeline.phases)
+        self.frames = tuple(toFrames(p.duration) for p in self.phases)
+        self.draws = tuple(tuple(p.draw) for p in self.phases)
+        self.responses = tuple(tuple(sorted(p.responses.items())) for p in self.phases)
+        self.timeout = toFrames(timeline.timeout)
+        self.timeoutResponse = timeline.timeoutResponse
+        self.hold = timeline.hold
+
+
+class Trial:
+    """A single trial of an experiment.
+
+    Attributes:
+      name (string): Name of the trial.
+      number (int): Position of the trial in the experiment.
+      experiment (Experiment): The experiment running the trial.
+      data (dictionary): Summary data recorded for the trial.
+      samples (FrameRecorder): Per-frame samples recorded for the
+        trial. Pass it as the `recorder` of `Experiment.run`.
+      trajectory (TrajectoryBuffer): The stick trajectory recorded
+        between `startTrajectory` and `stopTrajectory`, or None.
+      rumbles (tuple): ``(sMag, wMag, duration)`` of the rumble
+        effects the trial plays, uploaded by `prepare`. A magnitude
+        of None is the joystick's calibrated magnitude.
+    """
+
+    trajectory = None
+    rumbles = ()
+
+    def __init__(self, name, num, experiment):
+        self.name = name
+        self.number = num
+        self.experiment = experiment
+        self.data = {
+            "trial_name": name,
+            "trial_number": num,
+            "data": {},
+            "timing": {},
+        }
+        self.samples = FrameRecorder()
+
+    def prepare(self):
+        """Load what the trial needs before it runs.
+
+        `TrialPrefetcher` calls this on a worker thread while the
+        previous trial runs, so it must not build psychopy stims,
+        which need the window's GL context. Decode files with
+        ``experiment.assets.get`` here and build stims from the
+        cached data when the trial starts. By default the effects
+        in `rumbles` are uploaded to the joystick.
+        """
+        device = self.experiment.joystick
+        effects = getattr(device, "effects", None)
+        if effects is None:
+            return
+        for sMag, wMag, duration in self.rumbles:
+            if sMag is None:
+                sMag = device.strongMagnitude
+            if wMag is None:
+                wMag = device.weakMagnitude
+            effects.get(sMag, wMag, duration)
+
+    def fire(self):
+        """Run the trial. Overwrite with own function."""
+        pass
+
+    def release(self):
+        """Drop what `prepare` loaded once the trial has run.
+
+        Overwrite to free stims and other large objects; `data` is
+        kept, since it may still be waiting to be written.
+        """
+        pass
+
+    def markOnset(self, name, frameN):
+        """Record the onset of something shown on this frame.
+
+        Stores `frameN` as ``timing[name]`` and, once the window
+        flips, the flip time as ``timing[name + "_time"]``.
+        """
+        self.data["timing"][name] = frameN
+        self.experiment.stampNextFlip(self.data["timing"], name + "_time")
+
+    def markResponse(self, name, frameN, button):
+        """Record a response made with `button` on this frame.
+
+        Stores `frameN` as ``timing[name]`` and the kernel timestamp
+        of the button press as ``timing[name + "_time"]``.
+        """
+        self.data["timing"][name] = frameN
+        self.data["timing"][name + "_time"] = self.experiment.responseTime(button)
+
+    def startTrajectory(self, capacity=8192):
+        """Record the joystick's stick trajectory at its report rate.
+
+        Joysticks without an event stream, such as a `ReplayDevice`,
+        are not recorded and leave the trajectory empty; their
+        per-frame `samples` still hold the stick position.
+
+        Keyword arguments:
+          capacity (int): Reports the trial's buffer holds; at
+            1 kHz the default is about eight seconds.
+        """
+        if self.trajectory is None:
+            self.trajectory = TrajectoryBuffer(capacity)
+        self.trajectory.attach(self.experiment.joystick)
+
+    def stopTrajectory(self):
+        """Stop recording and store views of the trajectory as
+        ``data["trajectory"]``."""
+        self.trajectory.detach()
+        self.data["trajectory"] = self.trajectory.columns()
+        self.data["trajectory_dropped"] = self.trajectory.dropped
+
+    def reactionTime(self, onset, response="response"):
+        """Seconds between two marked times, or None if either
+        is missing."""
+        timing = self.data["timing"]
+        try:
+            return timing[response + "_time"] - timing[onset + "_time"]
+        except (KeyError, TypeError):
+            return None
+
+
+class TrialPrefetcher:
+    """Prepare upcoming trials on a worker thread.
+
+    Iterating yields the trials in order, each once its
+    `Trial.prepare` has finished. While a trial is out, the next
+    `depth` trials are prepared in the background, so the step from
+    one trial to the next only waits if preparing takes longer than
+    running. When the loop moves on, the finished trial's
+    `Trial.release` is called. An exception raised by `prepare` is
+    raised when its trial is reached.
+
+    Attributes:
+      trials (iterable): The trials, in running order.
+      depth (int): How many trials to prepare ahead.
+      waited (float): Seconds the loop has spent waiting for a
+        trial to be prepared.
+    """
+
+    def __init__(self, trials, depth=1):
+        """Create a prefetcher.
+
+        Arguments:
+          trials (iterable): The trials to run. They are taken from
+            the iterable only as they are prepared.
+
+        Keyword arguments:
+          depth (int): How many trials to prepare ahead of the one
+            running. With 0, each trial is prepared when it is
+            reached.
+        """
+        self.trials = trials
+        self.depth = depth
+        self.waited = 0.0
+
+    def __iter__(self):
+        trials = iter(self.trials)
+        pending = collections.deque()
+        pool = futures.ThreadPoolExecutor(1, thread_name_prefix="TrialPrefetcher")
+
+        def submit():
+            for trial in trials:
+                pending.append((trial, pool.submit(trial.prepare)))
+                return
+
+        try:
+            for i in range(self.depth + 1):
+                submit()
+            while pending:
+                trial, future = pending.popleft()
+                t0 = time.perf_counter()
+                future.result()
+                self.waited += time.perf_counter() - t0
+                try:
+                    yield trial
+                finally:
+                    trial.release()
+                submit()
+        finally:
+            for trial, future in pending:
+                future.cancel()
+            pool.shutdown()
+
+
+def _released(device):
+    """Input condition: true once no button is held."""
+    if True not in device.getAllButtons():
+        return True
+
+
+def _pressed(buttons=None):
+    """Input condition: the first of `buttons` that is held, or of
+    any button if `buttons` is None."""
+
+    def pressed(device):
+        for i, down in enumerate(device.getAllButtons()):
+            if down and (buttons is None or i in buttons):
+                return i
+
+    return pressed
+
+
+def buttonMask(buttons):
+    """Pack a sequence of button states into an int bitmask.
+
+    Bit `i` is set when button `i` is pressed.
+    """
+    mask = 0
+    for i, pressed in enumerate(buttons):
+        if pressed:
+            mask |= 1 << i
+    return mask
+
+
+class ColumnStore:
+    """Growable set of NumPy columns sharing one row count.
+
+    Each column is a preallocated array. Rows are written in place
+    and, when the arrays fill up, every column is reallocated at
+    twice its capacity, so appending costs no allocation in the
+    common case and amortized constant time overall.
+
+    Columns are read back with ``store[name]``, which returns a
+    view of the filled rows.
+    """
+
+    def __init__(self, columns, capacity=1024):
+        """Create an empty store.
+
+        Arguments:
+          columns (list): ``(name, dtype)`` or ``(name, dtype, shape)``
+            tuples describing each column. `shape` is the shape of
+            a single row.
+
+        Keyword arguments:
+          capacity (int): Number of rows to preallocate.
+        """
+        self.names = tuple(c[0] for c in columns)
+        self._arrays = [
+            np.zeros((capacity,) + tuple(c[2] if len(c) > 2 else ()), dtype=c[1])
+            for c in columns
+        ]
+        self._n = 0
+
+    def append(self, *values):
+        """Write one row; values are given in column order."""
+        i = self._n
+        if i == len(self._arrays[0]):
+            self._grow()
+        for array, value in zip(self._arrays, values):
+            array[i] = value
+        self._n = i + 1
+
+    def clear(self):
+        """Drop all rows, keeping the allocated capacity."""
+        self._n = 0
+
+    def columns(self):
+        """Return a dictionary of views of the filled rows."""
+        return {k: a[: self._n] for k, a in zip(self.names, self._arrays)}
+
+    @property
+    def capacity(self):
+        return len(self._arrays[0])
+
+    def _grow(self):
+        capacity = max(2 * self.capacity, 1)
+        for i, array in enumerate(self._arrays):
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[: self._n] = array[: self._n]
+            self._arrays[i] = grown
+
+    def __getitem__(self, name):
+        return self._arrays[self.names.index(name)][: self._n]
+
+    def __len__(self):
+        return self._n
+
+
+class FrameRecorder(ColumnStore):
+    """Columnar per-frame samples for a trial.
+
+    Stores the frame number, the time of the flip (seconds on
+    the monotonic clock), the stick position as returned by
+    `Experiment.stickPos` and the button state packed by
+    `buttonMask`.
+    """
+
+    def __init__(self, capacity=1024, nAxes=2):
+        """Create an empty recorder.
+
+        Keyword arguments:
+          capacity (int): Number of frames to preallocate. Storage
+            doubles whenever it is exhausted.
+          nAxes (int): Number of stick axes per sample.
+        """
+        super().__init__(
+            [
+                ("frame", np.int64),
+                ("time", np.float64),
+                ("axes", np.float64, (nAxes,)),
+                ("buttons", np.uint64),
+            ],
+            capacity,
+        )
+
+    def record(self, frameN, flipTime, axes, buttons):
+        """Record one frame's sample."""
+        self.append(frameN, flipTime, axes, buttons)
+
+
+class TrajectoryBuffer:
+    """Stick trajectory at the controller's own report rate.
+
+    Attached to a `HapticDevice`, the buffer stores one
+    ``(time, x, y)`` row for every report in which the stick's
+    axes changed, timed by the kernel's event timestamp (seconds on
+    the monotonic clock) and scaled to [-1, 1] like `getAllAxes`,
+    without the offset. The rows live in one preallocated ring
+    buffer, so recording allocates no arrays; once it is full the
+    oldest rows are overwritten and counted in `dropped`.
+
+    Use one buffer per trial and size it to hold the whole trial,
+    so the views returned by `columns` can be stored in the trial's
+    record without copying. Devices without an event stream, such
+    as a `ReplayDevice`, cannot be attached and record nothing.
+
+    Attributes:
+      codes (tuple): The ``EV_ABS`` codes of the x and y axes.
+      dropped (int): Rows overwritten since the buffer was cleared.
+    """
+
+    def __init__(self, capacity=8192, codes=(3, 4)):
+        """Create an empty buffer.
+
+        Keyword arguments:
+          capacity (int): Rows to preallocate.
+          codes (tuple): ``EV_ABS`` codes of the x and y axes.
+            Defaults to the right stick, ``ABS_RX`` and ``ABS_RY``.
+        """
+        self.codes = tuple(codes)
+        self._rows = np.zeros((max(capacity, 1), 3))
+        self._n = 0
+        self._next = 0
+        self.dropped = 0
+        self._changed = False
+        self._device = None
+        self._startedReader = False
+
+    def attach(self, device):
+        """Start recording a device's reports.
+
+        A device that is not being read has its reader started
+        until `detach`.
+
+        Returns:
+          False if the device has no event stream to record.
+        """
+        if self._device is not None:
+            self.detach()
+        if not hasattr(device, "addListener"):
+            return False
+        if getattr(device, "group", None) is None:
+            device.startReader()
+            self._startedReader = True
+        self._index = [device._AXIS_CODES.index(code) for code in self.codes]
+        self._device = device
+        device.addListener(self)
+        return True
+
+    def detach(self):
+        """Stop recording, and the device's reader if `attach`
+        started it."""
+        if self._device is None:
+            return
+        self._device.removeListener(self)
+        if self._startedReader:
+            self._startedReader = False
+            self._device.stopReader()
+        self._device = None
+
+    def __call__(self, event):
+        if event.type == ecodes.EV_ABS:
+            if event.code in self.codes:
+                self._changed = True
+        elif event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+            if self._changed:
+                self._changed = False
+                axes = self._device._snapshot[1]
+                self.append(
+                    self._device.eventTime(event),
+                    axes[self._index[0]],
+                    axes[self._index[1]],
+                )
+
+    def append(self, t, x, y):
+        """Write one row, overwriting the oldest if full."""
+        self._rows[self._next] = (t, x, y)
+        self._next += 1
+        if self._next == len(self._rows):
+            self._next = 0
+        if self._n < len(self._rows):
+            self._n += 1
+        else:
+            self.dropped += 1
+
+    def clear(self):
+        """Drop all rows, keeping the allocated capacity."""
+        self._n = self._next = self.dropped = 0
+
+    def view(self):
+        """The rows, oldest first, as an ``(n, 3)`` view.
+
+        If the buffer has wrapped, its rows are first rotated in
+        place, which is the only time exporting copies data.
+        """
+        n = self._n
+        if n == len(self._rows) and self._next:
+            self._rows[:] = np.roll(self._rows, -self._next, axis=0)
+            self._next = 0
+        return self._rows[:n]
+
+    def columns(self):
+        """Return ``t``, ``x`` and ``y`` views of the rows."""
+        rows = self.view()
+        return {"t": rows[:, 0], "x": rows[:, 1], "y": rows[:, 2]}
+
+    @property
+    def capacity(self):
+        return len(self._rows)
+
+    def __len__(self):
+        return self._n
+
+
+class FrameTimer(ColumnStore):
+    """Per-frame timing of the stages of `Experiment.run`.
+
+    For every frame it stores how long, in seconds, the
+    `on_run_loop` hook (``loop``), the draw callback (``callback``),
+    drawing the returned objects (``draw``) and the window flip
+    (``flip``) took, and the time since the previous flip
+    (``interval``, NaN for the first frame).
+
+    Attributes:
+      refreshPeriod (float): Expected seconds between flips. When
+        None, the median flip interval of the run is used.
+      dropThreshold (float): A frame counts as dropped when its
+        flip interval exceeds this many refresh periods.
+    """
+
+    STAGES = ("loop", "callback", "draw", "flip")
+
+    def __init__(self, capacity=1024, refreshPeriod=None, dropThreshold=1.5):
+        super().__init__(
+            [(stage, np.float64) for stage in self.STAGES + ("interval",)],
+            capacity,
+        )
+        self.refreshPeriod = refreshPeriod
+        self.dropThreshold = dropThreshold
+        self._lastFlip = None
+
+    def reset(self):
+        """Forget all frames, ready for a new run."""
+        self.clear()
+        self._lastFlip = None
+
+    def frame(self, loop, callback, draw, flip, flipTime):
+        """Record the stage durations of one frame."""
+        if self._lastFlip is None:
+            interval = np.nan
+        else:
+            interval = flipTime - self._lastFlip
+        self._lastFlip = flipTime
+        self.append(loop, callback, draw, flip, interval)
+
+    def dropped(self):
+        """Boolean array marking frames whose flip came late."""
+        intervals = self["interval"]
+        with np.errstate(invalid="ignore"):
+            return intervals > self.dropThreshold * self.period()
+
+    def period(self):
+        """The refresh period frames are judged against."""
+        if self.refreshPeriod is not None:
+            return self.refreshPeriod
+        intervals = self["interval"]
+        intervals = intervals[~np.isnan(intervals)]
+        return float(np.median(intervals)) if len(intervals) else np.nan
+
+    def summary(self, percentiles=(50, 90, 99), binWidth=1.0):
+        """Summarize the run in milliseconds.
+
+        Returns a dictionary of plain Python values, ready to be
+        stored in `Trial.data` or `Experiment.data`, holding the
+        number of frames, the refresh period, the number of
+        dropped frames, the mean, percentiles and maximum of each
+        stage and of the flip interval, and a histogram of flip
+        intervals.
+
+        Keyword arguments:
+          percentiles (tuple): Percentiles to report.
+          binWidth (float): Histogram bin width in milliseconds.
+        """
+        period = self.period()
+        summary = {
+            "frames": len(self),
+            "refresh_period": period * 1000,
+            "dropped": int(np.sum(self.dropped())),
+        }
+        for name in self.STAGES + ("interval",):
+            values = self[name] * 1000
+            values = values[~np.isnan(values)]
+            if not len(values):
+                continue
+            stats = {"mean": float(values.mean()), "max": float(values.max())}
+            for p, v in zip(percentiles, np.percentile(values, percentiles)):
+                stats[f"p{p}"] = float(v)
+            summary[name] = stats
+        intervals = self["interval"][1:] * 1000
+        if len(intervals):
+            top = max(intervals.max(), 2 * period * 1000) + binWidth
+            counts, edges = np.histogram(intervals, np.arange(0, top, binWidth))
+            summary["histogram"] = {"edges": edges.tolist(), "counts": counts.tolist()}
+        return summary
 
 
 class Data:
@@ -377,12 +3905,19 @@ class Data:
     dictionaries these keys are *ordered* and can
     be refered to either by name or position.
 
+    Keys are looked up through an index mapping each key to
+    its position in ``data``, so keyed reads and writes do not
+    scan the list. The index is kept in sync by ``__setitem__``
+    and ``append``; modifying ``data`` directly will leave it
+    stale.
+
     Attribute:
         data (list): A list of tuples to implement associative array
     """
 
     def __init__(self):
         self.data = []
+        self._index = {}
 
     def __getitem__(self, index):
         """
@@ -407,18 +3942,19 @@ class Data:
         elif isinstance(index, int):
             return self.data[index][1]
         elif isinstance(index, str):
-            # This should raise a KeyError if nothing is found
-            return [x[1] for x in self.data if x[0] == index][0]
+            # Raises a KeyError if nothing is found
+            return self.data[self._index[index]][1]
         else:
             raise ValueError()
 
     def __setitem__(self, index, value):
         """Implements the setting of key value pairs."""
-        match = [x for x in self.data if x[0] == index]
-        if len(match) == 0:
+        try:
+            i = self._index[index]
+        except KeyError:
+            self._index[index] = len(self.data)
             self.data.append((index, value))
         else:
-            i = self.data.index(match[0])
             self.data[i] = (index, value)
 
     def append(self, value):
@@ -427,6 +3963,9 @@ class Data:
         the list at the time.
         """
         i = len(self.data)
+        # An earlier entry may already use this key; lookups
+        #  keep resolving to the first one, as they always have.
+        self._index.setdefault(i, i)
         self.data.append((i, value))
 
     def __len__(self):
@@ -451,6 +3990,329 @@ class Data:
         return [x[0] for x in self.data]
 
 
+def _jsonDefault(obj):
+    """Serialize NumPy arrays and scalars found in records."""
+    try:
+        return obj.tolist()
+    except AttributeError:
+        raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def _flatten(record, prefix=""):
+    """Flatten nested dictionaries into dotted keys for CSV rows."""
+    flat = {}
+    for k, v in record.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            flat.update(_flatten(v, key + "."))
+        elif isinstance(v, (list, tuple)) or hasattr(v, "tolist"):
+            flat[key] = json.dumps(v, default=_jsonDefault)
+        else:
+            flat[key] = v
+    return flat
+
+
+class DataWriter:
+    """Append records to a file from a background thread.
+
+    Records are handed to the writer with `write`, which only puts
+    them on a bounded queue. A daemon thread serializes them and
+    appends them to the file, so disk I/O never runs on the thread
+    drawing the experiment. The file is flushed and ``fsync``-ed in
+    batches: after `fsyncEvery` records or `fsyncInterval` seconds,
+    whichever comes first, so a crash loses at most one batch.
+
+    Records are written as JSON lines, or as CSV rows with nested
+    dictionaries flattened to dotted column names. The CSV columns
+    are every key seen so far, so records of different kinds, such
+    as calibration steps and trials, can share a file: when a record
+    brings new keys the file is rewritten once with the wider header,
+    and earlier rows leave the new columns empty.
+
+    Attributes:
+      path (string): The file being written.
+      format (string): Either ``"jsonl"`` or ``"csv"``.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self, path, format=None, maxQueue=256, fsyncEvery=32, fsyncInterval=1.0
+    ):
+        """Open `path` for appending and start the writer thread.
+
+        Arguments:
+          path (string): File to append records to. Missing parent
+            directories are created.
+
+        Keyword arguments:
+          format (string): ``"jsonl"`` or ``"csv"``. Defaults to
+            ``"csv"`` for paths ending in ``.csv`` and ``"jsonl"``
+            otherwise.
+          maxQueue (int): Maximum number of records waiting to be
+            written. `write` blocks while the queue is full.
+          fsyncEvery (int): Records written between fsyncs.
+          fsyncInterval (float): Maximum seconds between fsyncs
+            while records are pending.
+
+        Raises:
+          ValueError: If `format` is not recognised.
+        """
+        if format is None:
+            format = "csv" if path.endswith(".csv") else "jsonl"
+        if format not in ("jsonl", "csv"):
+            raise ValueError(f"Unknown data format {format}")
+        self.path = path
+        self.format = format
+        self.fsyncEvery = fsyncEvery
+        self.fsyncInterval = fsyncInterval
+        self._error = None
+        self._csv = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", newline="")
+        self._queue = queue.Queue(maxQueue)
+        self._thread = threading.Thread(
+            target=self._run, name="DataWriter", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record):
+        """Queue a record for writing.
+
+        Raises:
+          RuntimeError: If the writer is closed.
+          OSError: If an earlier write failed on the writer thread.
+        """
+        if self._error is not None:
+            raise self._error
+        if not self._thread.is_alive():
+            raise RuntimeError(f"Writer for {self.path} is closed")
+        self._queue.put(record)
+
+    def close(self):
+        """Write everything still queued, fsync and close the file."""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        pending = 0
+        lastSync = time.monotonic()
+        try:
+            while True:
+                try:
+                    record = self._queue.get(timeout=self.fsyncInterval)
+                except queue.Empty:
+                    record = None
+                if record is self._STOP:
+                    break
+                if record is not None:
+                    self._writeRecord(record)
+                    pending += 1
+                now = time.monotonic()
+                if pending and (
+                    pending >= self.fsyncEvery or now - lastSync >= self.fsyncInterval
+                ):
+                    self._sync()
+                    pending = 0
+                    lastSync = now
+        except Exception as e:
+            self._error = e
+        finally:
+            try:
+                self._sync()
+            finally:
+                self._file.close()
+
+    def _writeRecord(self, record):
+        if self.format == "jsonl":
+            self._file.write(json.dumps(record, default=_jsonDefault) + "\n")
+            return
+        row = _flatten(record)
+        if self._csv is None:
+            fields = self._readHeader() or list(row)
+            self._csv = csv.DictWriter(self._file, fieldnames=fields)
+            if self._file.tell() == 0:
+                self._csv.writeheader()
+        new = [k for k in row if k not in self._csv.fieldnames]
+        if new:
+            self._widen(new)
+        self._csv.writerow(row)
+
+    def _readHeader(self):
+        """The columns of a CSV file being appended to, if any."""
+        if self._file.tell() == 0:
+            return None
+        with open(self.path, newline="") as f:
+            return next(csv.reader(f), None)
+
+    def _widen(self, fields):
+        """Rewrite the CSV file with `fields` added to its header."""
+        fields = self._csv.fieldnames + fields
+        self._file.flush()
+        tmp = f"{self.path}.tmp"
+        with open(self.path, newline="") as old, open(tmp, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(csv.DictReader(old))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._file.close()
+        self._file = open(self.path, "a", newline="")
+        self._csv = csv.DictWriter(self._file, fieldnames=fields)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+class EventLog:
+    """Binary log of raw device events, written through mmap.
+
+    The file is a 16-byte header, the magic ``b"HAPTEVT1"`` and the
+    record count as a little-endian uint64, followed by 16-byte
+    records of ``(time f8, type u2, code u2, value i4)``. Records
+    are packed straight into a memory map of the file, which is
+    grown `chunk` records at a time, so logging an event is a
+    single copy into memory the kernel writes back on its own. The
+    header's count is updated with every record, so a log cut short
+    by a crash is still readable up to its last event.
+
+    Attach a log to a `HapticDevice` with `HapticDevice.logEvents`
+    to record every event it reads and every ``EV_FF`` write it
+    makes, and load it with `readEventLog`.
+
+    Attributes:
+      path (string): The file being written.
+      count (int): Records in the log.
+    """
+
+    MAGIC = b"HAPTEVT1"
+    _HEADER = struct.Struct("<8sQ")
+    _RECORD = struct.Struct("<dHHi")
+
+    def __init__(self, path, chunk=65536):
+        """Open `path`, appending to it if it is already a log.
+
+        Arguments:
+          path (string): File to log to. Missing parent directories
+            are created.
+
+        Keyword arguments:
+          chunk (int): Records the file grows by when full.
+
+        Raises:
+          ValueError: If `path` exists but is not an event log.
+        """
+        self.path = path
+        self.chunk = max(chunk, 1)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self._fd).st_size
+        if size:
+            header = os.pread(self._fd, self._HEADER.size, 0)
+            magic, self.count = self._HEADER.unpack(header.ljust(self._HEADER.size))
+            if magic != self.MAGIC:
+                os.close(self._fd)
+                raise ValueError(f"{path} is not an event log")
+        else:
+            self.count = 0
+        self._map(self._HEADER.size + (self.count + self.chunk) * self._RECORD.size)
+        self._HEADER.pack_into(self._mmap, 0, self.MAGIC, self.count)
+        atexit.register(self.close)
+
+    def _map(self, size):
+        os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+        self._capacity = (size - self._HEADER.size) // self._RECORD.size
+
+    def append(self, t, type_, code, value):
+        """Log one event."""
+        with self._lock:
+            i = self.count
+            if i == self._capacity:
+                size = len(self._mmap) + self.chunk * self._RECORD.size
+                self._mmap.close()
+                self._map(size)
+            offset = self._HEADER.size + i * self._RECORD.size
+            self._RECORD.pack_into(self._mmap, offset, t, type_, code, value)
+            self.count = i + 1
+            struct.pack_into("<Q", self._mmap, 8, self.count)
+
+    def __call__(self, event):
+        """Log an evdev event; lets the log be a device listener."""
+        self.append(event.sec + event.usec * 1e-6, event.type, event.code, event.value)
+
+    def flush(self):
+        """Write the logged events back to disk now."""
+        with self._lock:
+            self._mmap.flush()
+
+    def close(self):
+        """Trim the unused part of the file and close it."""
+        with self._lock:
+            if self._fd is None:
+                return
+            self._mmap.flush()
+            self._mmap.close()
+            os.ftruncate(self._fd, self._HEADER.size + self.count * self._RECORD.size)
+            os.close(self._fd)
+            self._fd = None
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def readEventLog(path):
+    """Map an `EventLog` file into a NumPy structured array.
+
+    Nothing is parsed or copied: the array is a read-only memory
+    map of the file, with fields ``time``, ``type``, ``code`` and
+    ``value``, so even a long session loads immediately and only
+    the pages that are used are read from disk.
+
+    Raises:
+      ValueError: If `path` is not an event log.
+    """
+    with open(path, "rb") as f:
+        header = f.read(EventLog._HEADER.size)
+    if len(header) < EventLog._HEADER.size:
+        raise ValueError(f"{path} is not an event log")
+    magic, count = EventLog._HEADER.unpack(header)
+    if magic != EventLog.MAGIC:
+        raise ValueError(f"{path} is not an event log")
+    if count == 0:
+        return np.zeros(0, dtype=_eventDtype())
+    offset = EventLog._HEADER.size
+    return np.memmap(path, dtype=_eventDtype(), mode="r", offset=offset, shape=(count,))
+
+
+def _eventDtype():
+    """The record layout of an `EventLog`."""
+    return np.dtype(
+        [("time", "<f8"), ("type", "<u2"), ("code", "<u2"), ("value", "<i4")]
+    )
+
+
 if __name__ == "__main__":
-    dev = HapticDevice()
+    dev = _lazyClass("HapticDevice")()
     dev.calibrate()